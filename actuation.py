@@ -0,0 +1,201 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from clock import system_clock
+from confirmation import wait_for_state, wait_for_state_async
+from metrics import metrics
+from state_cache import state_cache as default_state_cache
+from tracing import tracer
+
+MAX_ATTEMPTS = 2
+
+# Shared workers so a transition does not pay for starting threads
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="light")
+
+
+class LightResult:
+    def __init__(self, light, target, site=''):
+        self.light = light
+        self.site = site
+        self.target = target
+        self.confirmed = False
+        self.skipped = False
+        self.attempts = 0
+        self.command_time = None
+        self.confirm_time = None
+        self.total_time = 0.0
+        self.error = None
+
+    def __repr__(self):
+        return (f"LightResult({self.key!r}, target={self.target}, confirmed={self.confirmed}, "
+                f"skipped={self.skipped}, attempts={self.attempts}, total={self.total_time:.2f}s)")
+
+    @property
+    def key(self):
+        # Unique across sites; the state cache, latency history and logs use it
+        return f"{self.site}/{self.light}" if self.site else self.light
+
+
+def _send_command(device, light, turn_on, result, clock):
+    operation = "on" if turn_on else "off"
+    started = clock.monotonic()
+    try:
+        if turn_on:
+            device.turn_on()
+        else:
+            device.turn_off()
+    except Exception as e:
+        result.error = str(e)
+        logging.error(f"Error turning {operation} {light} light: {e}")
+        return None
+    result.command_time = clock.monotonic() - started
+    logging.info(f"{light} light turned {operation}")
+    return started
+
+
+def _command(device, key, turn_on, result, clock):
+    with tracer.span('command', light=key, attempt=result.attempts):
+        return _send_command(device, key, turn_on, result, clock)
+
+
+def _state_check(state_cache, key, device, turn_on):
+    with tracer.span('state check', light=key):
+        return state_cache is not None and state_cache.is_current(key, device, turn_on)
+
+
+def _confirmed(result, confirmed, elapsed):
+    result.confirm_time = elapsed
+    if confirmed:
+        logging.info(f"{result.key} light confirmed {'on' if result.target else 'off'} after {elapsed:.2f}s")
+    return confirmed
+
+
+def _no_device(result):
+    result.error = "device not set up"
+    logging.error(f"No device set up for {result.key} light")
+    return result
+
+
+def _already(result, started, clock):
+    result.confirmed = result.skipped = True
+    result.total_time = clock.monotonic() - started
+    logging.info(f"{result.key} light already {'on' if result.target else 'off'}, no command sent")
+    return result
+
+
+def _next_attempt(result):
+    if result.attempts:
+        logging.info(f"Retrying {result.key} light")
+    result.attempts += 1
+
+
+def _update_cache(result, state_cache):
+    if state_cache is None:
+        return
+    if result.confirmed:
+        state_cache.record(result.key, result.target)
+    else:
+        state_cache.forget(result.key)
+
+
+def actuate_light(devices, light, turn_on, max_attempts=MAX_ATTEMPTS, state_cache=None, clock=system_clock, site=''):
+    result = LightResult(light, turn_on, site)
+    with tracer.span('light', light=result.key, target='on' if turn_on else 'off'):
+        return _actuate_light(devices, result, max_attempts, state_cache, clock)
+
+
+def _actuate_light(devices, result, max_attempts, state_cache, clock):
+    key, turn_on = result.key, result.target
+    started = clock.monotonic()
+    device = devices.get(result.light)
+    if device is None:
+        return _no_device(result)
+    if _state_check(state_cache, key, device, turn_on):
+        return _already(result, started, clock)
+
+    while result.attempts < max_attempts and not result.confirmed:
+        _next_attempt(result)
+        sent_at = _command(device, key, turn_on, result, clock)
+        if sent_at is not None:
+            with tracer.span('confirm', light=key, attempt=result.attempts):
+                confirmed, elapsed = wait_for_state(device, key, turn_on, sent_at, clock=clock)
+            result.confirmed = _confirmed(result, confirmed, elapsed)
+
+    _update_cache(result, state_cache)
+    result.total_time = clock.monotonic() - started
+    return result
+
+
+async def actuate_light_async(devices, light, turn_on, io, max_attempts=MAX_ATTEMPTS, state_cache=None,
+                              clock=system_clock, site=''):
+    # actuate_light for an event loop: io runs each blocking device call on a thread pool and the
+    # confirmation waits are awaited, so a light only holds a thread while a device call is in flight
+    result = LightResult(light, turn_on, site)
+    key = result.key
+    started = clock.monotonic()
+    device = devices.get(light)
+    if device is None:
+        return _no_device(result)
+    if await io(_state_check, state_cache, key, device, turn_on):
+        return _already(result, started, clock)
+
+    while result.attempts < max_attempts and not result.confirmed:
+        _next_attempt(result)
+        sent_at = await io(_command, device, key, turn_on, result, clock)
+        if sent_at is not None:
+            confirmed, elapsed = await wait_for_state_async(device, key, turn_on, sent_at, io, clock=clock)
+            result.confirmed = _confirmed(result, confirmed, elapsed)
+
+    await io(_update_cache, result, state_cache)
+    result.total_time = clock.monotonic() - started
+    return result
+
+
+def actuate_lights(devices, lights_to_control, max_attempts=MAX_ATTEMPTS, state_cache=default_state_cache,
+                   clock=system_clock):
+    if not lights_to_control:
+        return []
+    # All commands go out at the same time, on the shared workers
+    return clock.run_together([
+        partial(actuate_light, devices, light, turn_on, max_attempts, state_cache, clock)
+        for light, turn_on in lights_to_control
+    ], _executor)
+
+
+def record_light_metrics(result):
+    labels = {'site': result.site, 'light': result.light} if result.site else {'light': result.light}
+    if result.skipped:
+        metrics.inc('court_light_skipped_total', labels)
+        return
+    metrics.inc('court_light_commands_total', {**labels, 'operation': 'on' if result.target else 'off'},
+                result.attempts)
+    if result.attempts > 1:
+        metrics.inc('court_light_retries_total', labels, result.attempts - 1)
+    if not result.confirmed:
+        metrics.inc('court_light_failures_total', labels)
+    metrics.observe('court_light_command_seconds', result.command_time, labels)
+    if result.confirmed:
+        metrics.observe('court_light_confirm_seconds', result.confirm_time, labels)
+
+
+def report_results(results, journal, events):
+    # After a transition: metrics for every light, confirmed states to the journal and event store, and the logs
+    if not results:
+        return
+    events.record([(result.light, result.target, result.attempts) for result in results if result.confirmed],
+                  results[0].site)
+    for result in results:
+        state = 'on' if result.target else 'off'
+        record_light_metrics(result)
+        if result.confirmed:
+            journal.record_light(result.light, result.target)
+        if result.skipped:
+            continue
+        if result.confirmed:
+            if result.attempts > 1:
+                logging.info(f"Successfully turned {result.key} light {state} on retry")
+        else:
+            logging.error(f"Failed to turn {result.key} light {state} after {result.attempts} attempt(s)")
+    logging.info("Light transition finished in " + ", ".join(
+        f"{result.key}: {result.total_time:.1f}s" for result in results))
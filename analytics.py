@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+from config import EVENTS_FILE
+from events import connect
+
+PERIODS = ('day', 'month')
+
+
+def bucket_starts(first, last, period='day'):
+    # Local midnights from the bucket holding `first` up to and including the one after `last`
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    if period == 'month':
+        first = first.replace(day=1)
+    starts = []
+    current = first
+    while current <= last:
+        starts.append(current)
+        if period == 'month':
+            current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+        else:
+            current += timedelta(days=1)
+    starts.append(current)
+    return [datetime.combine(day, datetime.min.time()) for day in starts]
+
+
+def load_rows(path, start_ts, end_ts):
+    # Events in the range, the last event of each light before it (so on-time carries over),
+    # and the planned stretches overlapping it
+    if not path or not os.path.exists(path):
+        return [], [], []
+    connection = connect(path, readonly=True)
+    try:
+        before = connection.execute(
+            "SELECT MAX(ts), site, light, state, 0 FROM light_events WHERE ts < ? GROUP BY site, light",
+            (start_ts,)).fetchall()
+        inside = connection.execute(
+            "SELECT ts, site, light, state, commands FROM light_events WHERE ts >= ? AND ts < ?",
+            (start_ts, end_ts)).fetchall()
+        planned = connection.execute(
+            "SELECT start, end, site, light, rule FROM planned_light WHERE start < ? AND end > ?",
+            (end_ts, start_ts)).fetchall()
+    except sqlite3.OperationalError:
+        return [], [], []
+    finally:
+        connection.close()
+    return before, inside, planned
+
+
+def _split(np, starts, ends, edges):
+    # Cut intervals at bucket edges: returns (interval index, bucket, piece start, piece end)
+    first = np.searchsorted(edges, starts, side='right') - 1
+    last = np.searchsorted(edges, ends, side='left') - 1
+    pieces = np.maximum(last - first + 1, 0)
+    interval = np.repeat(np.arange(len(starts)), pieces)
+    offsets = np.cumsum(pieces) - pieces
+    bucket = first[interval] + np.arange(len(interval)) - offsets[interval]
+    return (interval, bucket, np.maximum(starts[interval], edges[bucket]),
+            np.minimum(ends[interval], edges[bucket + 1]))
+
+
+def usage(first, last, period='day', path=EVENTS_FILE, now=None):
+    import numpy as np
+
+    starts = bucket_starts(first, last, period)
+    edges = np.array([moment.timestamp() for moment in starts])
+    horizon = min(edges[-1], now if now is not None else time.time())
+    before, inside, planned = load_rows(path, edges[0], edges[-1])
+    events = [(edges[0],) + tuple(row[1:]) for row in before] + list(inside)
+
+    names = sorted({(site, light) for _, site, light, *_ in events})
+    key_of = {name: i for i, name in enumerate(names)}
+    planned = [row for row in planned if (row[2], row[3]) in key_of]
+    rules = sorted({row[4] for row in planned})
+    rule_of = {rule: i for i, rule in enumerate(rules)}
+    lights, buckets = len(names), len(starts) - 1
+
+    ts = np.array([row[0] for row in events], dtype=np.float64)
+    key = np.array([key_of[(row[1], row[2])] for row in events], dtype=np.int64)
+    state = np.array([row[3] for row in events], dtype=np.float64)
+    commands = np.array([row[4] for row in events], dtype=np.int64)
+
+    # Each event holds until the next event of the same light, or the end of the range
+    order = np.lexsort((ts, key))
+    ts, key, state, commands = ts[order], key[order], state[order], commands[order]
+    ends = np.full(len(ts), horizon)
+    if len(ts) > 1:
+        ends[:-1] = np.where(key[1:] == key[:-1], ts[1:], horizon)
+    begins = np.minimum(np.maximum(ts, edges[0]), horizon)
+    lengths = np.maximum(np.minimum(ends, horizon) - begins, 0)
+    lit = lengths * state
+    lit_before = np.cumsum(lit) - lit
+
+    # On-time of light k up to t, F_k(t), from one binary search over all lights laid end to end
+    span = edges[-1] - edges[0] + 1
+    axis = begins - edges[0] + key * span
+    light_start = np.searchsorted(key, np.arange(lights))
+
+    def on_time_until(moments, keys):
+        position = np.searchsorted(axis, moments - edges[0] + keys * span, side='right') - 1
+        valid = (position >= 0) & (key[np.maximum(position, 0)] == keys)
+        position = np.maximum(position, 0)
+        partial = np.clip(moments - begins[position], 0, lengths[position]) * state[position]
+        total = lit_before[position] - lit_before[light_start[keys]] + partial
+        return np.where(valid, total, 0.0)
+
+    every_light = np.repeat(np.arange(lights), buckets + 1)
+    at_edges = on_time_until(np.tile(edges, lights), every_light).reshape(lights, buckets + 1)
+    on_hours = np.diff(at_edges, axis=1).T / 3600.0  # (bucket, light)
+
+    plan_start = np.array([row[0] for row in planned], dtype=np.float64)
+    plan_end = np.minimum(np.array([row[1] for row in planned], dtype=np.float64), horizon)
+    plan_key = np.array([key_of[(row[2], row[3])] for row in planned], dtype=np.int64)
+    plan_rule = np.array([rule_of[row[4]] for row in planned], dtype=np.int64)
+    plan_start = np.maximum(plan_start, edges[0])
+    keep = plan_end > plan_start
+    interval, bucket, piece_start, piece_end = _split(np, plan_start[keep], plan_end[keep], edges)
+    piece_key, piece_rule = plan_key[keep][interval], plan_rule[keep][interval]
+    covered = on_time_until(piece_end, piece_key) - on_time_until(piece_start, piece_key)
+    by_rule = np.bincount((bucket * lights + piece_key) * len(rules) + piece_rule, weights=covered,
+                          minlength=buckets * lights * len(rules)).reshape(buckets, lights, len(rules)) / 3600.0
+
+    counted = commands > 0
+    sent = np.bincount((np.searchsorted(edges, ts[counted], side='right') - 1) * lights + key[counted],
+                       weights=commands[counted], minlength=buckets * lights).reshape(buckets, lights)
+
+    reservation = rule_of.get('reservation')
+    reserved = by_rule[:, :, reservation] if reservation is not None else np.zeros((buckets, lights))
+    labels = [f"{site}/{light}" if site else light for site, light in names]
+
+    def summary(hours, rule_hours, reserved_hours, count):
+        unplanned = hours - rule_hours.sum()
+        breakdown = {name: round(float(value), 3) for name, value in zip(rules, rule_hours) if value > 0.0005}
+        if unplanned > 0.0005:
+            breakdown['unplanned'] = round(float(unplanned), 3)
+        return {
+            'on_hours': round(float(hours), 3),
+            'outside_reservation_hours': round(float(hours - reserved_hours), 3),
+            'commands': int(count),
+            'by_rule': breakdown,
+        }
+
+    return {
+        'period': period,
+        'from': starts[0].date().isoformat(),
+        'until': (starts[-1] - timedelta(days=1)).date().isoformat(),
+        'buckets': [
+            {'start': starts[b].date().isoformat(),
+             'lights': {labels[k]: summary(on_hours[b, k], by_rule[b, k], reserved[b, k], sent[b, k])
+                        for k in range(lights)}}
+            for b in range(buckets)
+        ],
+        'totals': {labels[k]: summary(on_hours[:, k].sum(), by_rule[:, k].sum(axis=0), reserved[:, k].sum(),
+                                      sent[:, k].sum())
+                   for k in range(lights)},
+        'by_rule': {name: round(float(value), 3) for name, value in zip(rules, by_rule.sum(axis=(0, 1)))},
+    }
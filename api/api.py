@@ -1,15 +1,114 @@
-from flask import Flask, jsonify
-from datetime import datetime
+from flask import Flask, jsonify, request, Response
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import random
+import time
 
 app = Flask(__name__)
 
+SAMPLE_RESERVATIONS = {"reservations":{"05:30":["Half Court A"],"06:30":["Half Court B",],"07:30":["Half Court B.","Half Court A."],"08:30":["Full Court"],"09:30":["Full Court"],"10:30":["Full Court"],"11:30":["Full Court"],"12:30":["Full Court"],"13:30":["Full Court"],"14:30":["Full Court"],"15:30":["Full Court"],"16:30":["Full Court"],"17:30":["Full Court"],"18:30":["Half Court A.","Half Court B."],"19:30":["Half Court A.","Half Court B."],"20:30":["Half Court B."],"21:30":["Full Court"]},"last_updated":"2024-09-01 02:52:29"}
+
+GENERATOR_PARAMS = ('date', 'courts', 'density', 'start', 'end', 'step', 'seed')
+
+# Fault injection, changeable at runtime through /config or per request through query parameters
+faults = {
+    'latency': float(os.getenv('MOCK_API_LATENCY', '0')),          # seconds added to every response
+    'jitter': float(os.getenv('MOCK_API_JITTER', '0')),            # random extra seconds, 0..jitter
+    'error_rate': float(os.getenv('MOCK_API_ERROR_RATE', '0')),    # share of 503 responses
+    'timeout_rate': float(os.getenv('MOCK_API_TIMEOUT_RATE', '0')),  # share of responses that hang
+    'timeout_seconds': float(os.getenv('MOCK_API_TIMEOUT_SECONDS', '30')),
+    'malformed_rate': float(os.getenv('MOCK_API_MALFORMED_RATE', '0')),  # share of truncated JSON bodies
+}
+
+
+def court_names(count):
+    names = ['Half Court A', 'Half Court B', 'Full Court']
+    return names[:count] + [f"Court {n}" for n in range(4, count + 1)]
+
+
+def generate_reservations(day, courts=3, density=0.7, start="05:30", end="22:30", step=60, seed=None):
+    rng = random.Random(seed if seed is not None else day.toordinal())
+    names = court_names(courts)
+    slot = datetime.combine(day, datetime.strptime(start, "%H:%M").time())
+    last_slot = datetime.combine(day, datetime.strptime(end, "%H:%M").time())
+    reservations = {}
+    while slot < last_slot:
+        if courts == 3:
+            # The full court and the two halves are the same floor, so they never overlap
+            if rng.random() < density / 2:
+                booked = ['Full Court']
+            else:
+                booked = [name for name in names[:2] if rng.random() < density]
+        else:
+            booked = [name for name in names if rng.random() < density]
+        if booked:
+            # The real API sometimes leaves a trailing dot on multi-court bookings
+            reservations[slot.strftime("%H:%M")] = [
+                name + '.' if len(booked) > 1 and rng.random() < 0.3 else name for name in booked
+            ]
+        slot += timedelta(minutes=step)
+    return {
+        "reservations": reservations,
+        "last_updated": datetime.combine(day, datetime.min.time()).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def payload_for(args):
+    if not any(param in args for param in GENERATOR_PARAMS):
+        return SAMPLE_RESERVATIONS
+    day = datetime.strptime(args['date'], "%Y-%m-%d").date() if 'date' in args else datetime.now().date()
+    return generate_reservations(
+        day,
+        courts=int(args.get('courts', 3)),
+        density=float(args.get('density', 0.7)),
+        start=args.get('start', "05:30"),
+        end=args.get('end', "22:30"),
+        step=int(args.get('step', 60)),
+        seed=int(args['seed']) if 'seed' in args else None,
+    )
+
+
+def fault(name):
+    return float(request.args.get(name, faults[name]))
+
+
 @app.route('/reservations', methods=['GET'])
 def get_reservations():
-    # Sample data similar to what you want to return
-    reservations_data = {"reservations":{"05:30":["Half Court A"],"06:30":["Half Court B",],"07:30":["Half Court B.","Half Court A."],"08:30":["Full Court"],"09:30":["Full Court"],"10:30":["Full Court"],"11:30":["Full Court"],"12:30":["Full Court"],"13:30":["Full Court"],"14:30":["Full Court"],"15:30":["Full Court"],"16:30":["Full Court"],"17:30":["Full Court"],"18:30":["Half Court A.","Half Court B."],"19:30":["Half Court A.","Half Court B."],"20:30":["Half Court B."],"21:30":["Full Court"]},"last_updated":"2024-09-01 02:52:29"}
-    
-    return jsonify(reservations_data)
+    delay = fault('latency') + random.uniform(0, fault('jitter'))
+    if random.random() < fault('timeout_rate'):
+        delay += fault('timeout_seconds')
+    if delay:
+        time.sleep(delay)
+
+    if random.random() < fault('error_rate'):
+        return jsonify(error="injected failure"), 503
+
+    try:
+        reservations_data = payload_for(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    body = json.dumps(reservations_data, separators=(',', ':'))
+    if random.random() < fault('malformed_rate'):
+        return Response(body[:len(body) // 2], mimetype='application/json')
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest())
+    response.last_modified = datetime.strptime(reservations_data['last_updated'], "%Y-%m-%d %H:%M:%S")
+    return response.make_conditional(request)
+
+
+@app.route('/config', methods=['GET', 'POST'])
+def configure():
+    if request.method == 'POST':
+        updates = request.get_json(force=True) or {}
+        unknown = set(updates) - set(faults)
+        if unknown:
+            return jsonify(error=f"Unknown settings: {', '.join(sorted(unknown))}"), 400
+        faults.update({name: float(value) for name, value in updates.items()})
+    return jsonify(faults)
 
 if __name__ == '__main__':
     app.run(debug=True)
-
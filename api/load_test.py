@@ -0,0 +1,121 @@
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# A fresh data directory, so no cache, prefetched day or journal of a real install can answer for the API
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='load-test-')
+
+import requests
+from werkzeug.serving import make_server
+
+import api as mock_api
+import app
+from fetcher import ReservationFetcher
+from metrics import metrics
+
+
+class CountingFetcher(ReservationFetcher):
+    # Counts every request, so retries and their failures show up next to the calls they belong to
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = 0
+        self.errors = 0
+
+    def fetch(self):
+        self.requests += 1
+        try:
+            return super().fetch()
+        except Exception:
+            self.errors += 1
+            raise
+
+
+def start_local_server():
+    server = make_server('127.0.0.1', 0, mock_api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/reservations"
+
+
+def run_client(url, count, retries, conditional, read_timeout):
+    # One client per worker, each with its own pooled session, like separate Pis polling the API
+    fetcher = CountingFetcher(url=url, cache_file=None, read_timeout=read_timeout)
+    samples = []
+    for _ in range(count):
+        if not conditional:
+            fetcher.cache = None
+        started = time.perf_counter()
+        # Without the cache fallbacks, a call only succeeds if one of its requests did
+        reservations = app.get_reservations_with_retry(max_retries=retries, retry_delay=0, fetcher=fetcher,
+                                                       use_cache=False)
+        samples.append((time.perf_counter() - started, reservations is not None))
+    return samples, fetcher.requests, fetcher.errors
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test get_reservations_with_retry against the mock API")
+    parser.add_argument('--url', help="use a running server instead of starting one in-process")
+    parser.add_argument('--query', default='', help="generator parameters, e.g. 'courts=40&density=0.9&step=15'")
+    parser.add_argument('--requests', type=int, default=500, help="total calls across all clients")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--read-timeout', type=float, default=5.0)
+    parser.add_argument('--no-conditional', action='store_true', help="always download the full payload")
+    for name in mock_api.faults:
+        parser.add_argument(f"--{name.replace('_', '-')}", type=float, dest=name)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    metrics.enabled = False
+
+    faults = {name: getattr(args, name) for name in mock_api.faults if getattr(args, name) is not None}
+    server = None
+    if args.url:
+        url = args.url
+        if faults:
+            requests.post(url.rsplit('/', 1)[0] + '/config', json=faults, timeout=5).raise_for_status()
+    else:
+        mock_api.faults.update(faults)
+        server, url = start_local_server()
+    if args.query:
+        url = f"{url}?{args.query}"
+
+    per_client = [args.requests // args.concurrency + (i < args.requests % args.concurrency)
+                  for i in range(args.concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        runs = list(pool.map(lambda count: run_client(url, count, args.retries, not args.no_conditional,
+                                                      args.read_timeout), per_client))
+    elapsed = time.perf_counter() - started
+    if server is not None:
+        server.shutdown()
+    shutil.rmtree(os.environ['DATA_DIR'], ignore_errors=True)
+
+    samples = [sample for run, _, _ in runs for sample in run]
+    sent = sum(count for _, count, _ in runs)
+    errors = sum(count for _, _, count in runs)
+    latencies = [latency * 1000 for latency, _ in samples]
+    failures = sum(1 for _, ok in samples if not ok)
+    print(f"{len(samples)} calls in {elapsed:.2f}s ({len(samples) / elapsed:.1f}/s) "
+          f"with {args.concurrency} clients, {failures} failed")
+    print(f"{sent} requests, {errors} failed ({errors / sent if sent else 0.0:.1%})")
+    print(f"latency ms: p50 {percentile(latencies, 50):.1f}  p90 {percentile(latencies, 90):.1f}  "
+          f"p99 {percentile(latencies, 99):.1f}  max {max(latencies, default=0.0):.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,306 +1,212 @@
 import logging
-from datetime import datetime, timedelta
-import time
+import os
+from datetime import datetime
 import requests
-import schedule
 import threading
 import sys
-import os
 import signal
 
-from config import API_URL, setup_devices, check_device_status
+from config import SITES_FILE, setup_devices
+from actuation import actuate_lights, report_results
+from clock import system_clock
+from events import event_store, planned_rows
+from fetcher import ReservationFetcher
+from journal import state_journal
+from prefetch import ReservationPrefetcher
+from scheduler import QUEUE, SKIP, Scheduler
+from state_cache import state_cache as device_state_cache
+from tracing import traced, tracer
+from timeline import (CourtState, PlanRunner, clean_court_names, compile_day, describe_state, device_targets,
+                      diff_reservations, explain_day)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Global variables
 current_reservations = None
-daily_routine_running = False
+daily_routine_lock = threading.Lock()
+plan_runner = None
 exit_flag = threading.Event()
+reservations_lock = threading.RLock()
+reservation_fetcher = ReservationFetcher()
+reservation_prefetcher = ReservationPrefetcher()
+scheduler = Scheduler(exit_flag)
 
-def control_light(devices, half_a_on, half_b_on, full_on):
-    try:
-        lights_to_control = []
-        failed_lights = []
-
-        # Determine which lights need to be on or off
-        lights_to_control.append(('Full Court', full_on or half_a_on or half_b_on))
-        lights_to_control.append(('Half Court A', half_a_on))
-        lights_to_control.append(('Half Court B', half_b_on))
-        
-        def attempt_light_operation(light, turn_on):
-            operation = "on" if turn_on else "off"
-            try:
-                # Turn light on/off
-                if turn_on:
-                    devices[light].turn_on()
-                else:
-                    devices[light].turn_off()
-                logging.info(f"{light} light turned {operation}")
-                return True
-            except Exception as e:
-                logging.error(f"Error turning {operation} {light} light: {e}")
-                return False
-
-        def check_light_status(light, expected_state):
-            try:
-                status = check_device_status(devices[light], expected_state)
-                if status is True:
-                    logging.info(f"{light} light confirmed {'on' if expected_state else 'off'}")
-                    return True
-                elif status is False:
-                    logging.warning(f"{light} light is in the wrong state")
-                    return False
-                else:  # status is None
-                    logging.warning(f"Unable to confirm {light} light state")
-                    return False
-            except Exception as e:
-                logging.error(f"Error checking {light} light status: {e}")
-                return False
-
-        # Process lights
-        for light, should_be_on in lights_to_control:
-            # Attempt to turn light on/off
-            if attempt_light_operation(light, should_be_on):
-                
-                time.sleep(10)
-                
-                # Check light status
-                if not check_light_status(light, should_be_on):
-                    failed_lights.append((light, should_be_on))
-                
-                
-                time.sleep(10)
-            else:
-                failed_lights.append((light, should_be_on))
-
-        # Retry failed lights
-
-        for light, should_be_on in failed_lights:
-            logging.info(f"Retrying {light} light")
-            if attempt_light_operation(light, should_be_on):
-                
-                time.sleep(10)
-                
-                if check_light_status(light, should_be_on):
-                    logging.info(f"Successfully turned {light} light {'on' if should_be_on else 'off'} on retry")
-                else:
-                    logging.error(f"Failed to confirm {light} light state after retry")
-            else:
-                logging.error(f"Failed to turn {light} light {'on' if should_be_on else 'off'} on retry")
+@traced('control_light')
+def control_light(devices, half_a_on, half_b_on, full_on, clock=system_clock, state_cache=device_state_cache,
+                  journal=state_journal, events=event_store):
+    # Determine which lights need to be on or off
+    lights_to_control = device_targets(CourtState(half_a_on, half_b_on, full_on))
 
+    try:
+        results = actuate_lights(devices, lights_to_control, state_cache=state_cache, clock=clock)
     except Exception as e:
         logging.error(f"Error controlling lights: {e}")
+        return []
+
+    report_results(results, journal, events)
+    return results
 
 def convert_to_24hr(time_str):
     time_obj = datetime.strptime(time_str, "%I:%M %p")
     return time_obj.strftime("%H:%M")
 
-def get_reservations_from_api():
-    headers = {
-        "Accept": "application/json",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-    }
+def todays_fetcher():
+    # With prefetching on, the daily routine, the checks and the background refresh share today's dated copy,
+    # so the running plan has one source and a later fetch can never roll it back to an older one
+    if reservation_prefetcher.days > 0:
+        return reservation_prefetcher.fetcher_for(datetime.now().date())
+    return reservation_fetcher
+
+def get_reservations_from_api(fetcher=None):
     try:
-        response = requests.get(API_URL, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data['reservations']
+        return (fetcher or todays_fetcher()).fetch()
     except requests.RequestException as e:
         logging.error(f"Error fetching data from API: {e}")
         return None
+    except (ValueError, KeyError) as e:
+        logging.error(f"Invalid reservation data from API: {e}")
+        return None
 
-def clean_court_names(reservations):
-    return {
-        time: [court.rstrip('.') for court in courts]
-        for time, courts in reservations.items()
-    }
-
-def control_lights(devices, reservations):
-    current_time = datetime.now()
+@traced('control_lights')
+def control_lights(devices, reservations, clock=system_clock, state_cache=device_state_cache, journal=state_journal,
+                   events=event_store):
+    global plan_runner
+    current_time = clock.now()
+    day = current_time.date()
+    if current_time.weekday() >= 5:
+        logging.info("Today is a weekend. Activating weekend schedule.")
 
-    # Check if today is a weekend
-    is_weekend = current_time.weekday() >= 5  # 5 is Saturday, 6 is Sunday
+    with tracer.span('compile plan'):
+        journal.record_reservations(day, reservations)
+        events.record_plan(day, planned_rows(explain_day(reservations, day), device_targets))
+        plan = compile_day(reservations, day)
+    logging.info(f"Compiled {len(plan)} light transitions for {current_time.strftime('%Y-%m-%d')}:")
+    for transition in plan:
+        logging.info(f"  {transition.at.strftime('%H:%M')} {describe_state(transition.state)} ({transition.reason})")
+
+    def apply_state(state):
+        results = control_light(devices, state.half_a, state.half_b, state.full, clock, state_cache, journal,
+                                events)
+        return bool(results) and all(result.confirmed for result in results)
+
+    def on_applied(transition):
+        journal.record_applied(day, transition)
+
+    # After a restart the journal tells us whether the lights already match the current transition
+    resume = journal.resume_point(day, plan, device_targets)
+    if resume is not None:
+        logging.info(f"Resuming from the state journal: {describe_state(resume.state)} since "
+                     f"{resume.at.strftime('%H:%M')} is already confirmed, no commands needed")
+
+    plan_runner = PlanRunner(plan, day, apply_state, exit_flag, clock, resume_from=resume, on_applied=on_applied)
+    try:
+        if plan_runner.run():
+            logging.info("All reservations processed. All lights turned OFF after additional time")
+    finally:
+        plan_runner = None
 
-    if is_weekend:
-        logging.info("Today is a weekend. Activating weekend schedule.")
 
-        # Define the weekend morning activation period
-        weekend_start_time = current_time.replace(hour=4, minute=30, second=0, microsecond=0)
-        weekend_end_time = current_time.replace(hour=5, minute=30, second=0, microsecond=0)
-
-        if current_time < weekend_start_time:
-            wait_time = (weekend_start_time - current_time).total_seconds()
-            logging.info(f"Waiting until {weekend_start_time.strftime('%H:%M')} to turn on lights for the weekend morning.")
-            time.sleep(wait_time)
-            current_time = datetime.now()  # Update current_time after sleep
-
-        if weekend_start_time <= current_time < weekend_end_time:
-            logging.info("Turning on all lights for the weekend morning period (04:30 - 05:30).")
-            control_light(devices, True, True, True)
-            while current_time < weekend_end_time:
-                time.sleep(60)
-                current_time = datetime.now()
-            logging.info("Weekend morning period ended. Processing reservations.")
-            current_time = datetime.now()  # Update current_time after sleep
-    
-    # Sort reservations by time
-    sorted_reservations = sorted(reservations.items(), key=lambda x: datetime.strptime(x[0], "%H:%M"))
-
-    # Find the earliest reservation time
-    if sorted_reservations:
-        earliest_reservation = datetime.strptime(sorted_reservations[0][0], "%H:%M").replace(
-            year=current_time.year,
-            month=current_time.month,
-            day=current_time.day
-        )
-        if not is_weekend:
-            # Calculate 15 minutes before the earliest reservation
-            early_activation_time = earliest_reservation - timedelta(minutes=15)
-
-            # If it's past midnight and before the early activation time, wait until then
-            if current_time.time() < early_activation_time.time():
-                wait_time = (early_activation_time - current_time).total_seconds()
-                logging.info(f"Waiting until {early_activation_time.strftime('%H:%M')} to turn on lights for first reservation")
-                time.sleep(wait_time)
-                current_time = datetime.now()  # Update current_time after sleep
-                control_light(devices, True, True, True)
-                logging.info("Lights turned on for weekday early morning activation")
-                while current_time < earliest_reservation:
-                    time.sleep(60)
-                    current_time = datetime.now()
-                logging.info("Weekday morning period ended. Processing reservations.")
-                current_time = datetime.now()  # Update current_time after sleep
-
-    off_start_time = current_time.replace(hour=7, minute=30, second=0, microsecond=0)
-    off_end_time = current_time.replace(hour=17, minute=30, second=0, microsecond=0)
-    all_on_start_time = current_time.replace(hour=17, minute=30, second=0, microsecond=0)
-    all_on_end_time = current_time.replace(hour=18, minute=30, second=0, microsecond=0)
-
-    for reservation_time, courts in sorted_reservations:
-        reservation_datetime = datetime.strptime(reservation_time, "%H:%M").replace(
-            year=current_time.year,
-            month=current_time.month,
-            day=current_time.day
-        )
-
-        if current_time > reservation_datetime + timedelta(minutes=59):
-            logging.info(f"Skipping reservation at {reservation_time} as it's passed")
-            continue
-
-
-        if off_start_time <= current_time < off_end_time:
-            logging.info("Current time is within the off period (07:30 - 17:30). Turning off all lights.")
-            control_light(devices, False, False, False)
-
-            # Wait until the off period ends
-            wait_time = (off_end_time - current_time).total_seconds()
-            time.sleep(wait_time)
-            logging.info("Off period ended. Resuming reservation processing.")
-            current_time = datetime.now()  # Update current_time after sleep
-
-        if all_on_start_time <= current_time < all_on_end_time:
-            logging.info("Current time is within the all-on period (17:30 - 18:30). Turning on all lights.")
-            control_light(devices, True, True, True)
-                
-            # Wait until the all-on period ends
-            wait_time = (all_on_end_time - current_time).total_seconds()
-            time.sleep(wait_time)
-            current_time = datetime.now()  # Update current_time after sleep
-
-        if reservation_datetime > current_time:
-            control_light(devices, False, False, False)
-            if all_on_start_time < reservation_datetime:
-                wait_time = (all_on_start_time - current_time).total_seconds()
-                next_on_time = all_on_start_time
-            else:
-                wait_time = (reservation_datetime - current_time).total_seconds()
-                next_on_time = reservation_datetime
-            logging.info(f"Waiting for {wait_time} seconds until next reservation at {next_on_time}")
-            time.sleep(wait_time)
-            current_time = datetime.now()  # Update current_time after sleep
-
-        # Determine which lights should be on for this reservation
-        half_a_on = 'Half Court A' in courts or 'Full Court' in courts
-        half_b_on = 'Half Court B' in courts or 'Full Court' in courts
-        full_on = 'Full Court' in courts
-
-        # Control the lights based on the current reservation needs
-        control_light(devices, half_a_on, half_b_on, full_on)
-
-        logging.info(f"Reservation started at {reservation_time} for {', '.join(courts)}")
-
-        end_time = reservation_datetime + timedelta(minutes=60)
-
-        # Wait until the end of the current reservation
-        while current_time < end_time:
-            time.sleep(60)
-            current_time = datetime.now()  # Update current_time after sleep
-
-    logging.info("All reservations processed. Keeping some lights on for additional time.")
-    control_light(devices, True, True, True)
-    time.sleep(300)  # 5 minutes
-    control_light(devices, False, False, True)
-    time.sleep(600)  # Another 10 minutes
-    control_light(devices, False, False, False)
-    logging.info("All lights turned OFF after additional time")
-
-
-def get_reservations_with_retry(max_retries=2, retry_delay=300):
+@traced('get_reservations_with_retry')
+def get_reservations_with_retry(max_retries=2, retry_delay=300, fetcher=None, use_cache=True):
+    fetcher = fetcher or todays_fetcher()
     for attempt in range(max_retries):
-        reservations = get_reservations_from_api()
+        with tracer.span('fetch reservations', attempt=attempt + 1):
+            reservations = get_reservations_from_api(fetcher)
         if reservations:
             return clean_court_names(reservations)
         logging.error(f"Failed to fetch reservations. Attempt {attempt + 1}/{max_retries}")
+
+        # Only a start of day falls back to a stored copy; a check must never apply one over a newer plan
+        cached = fetcher.cached_reservations(datetime.now().date()) if use_cache else None
+        if cached:
+            logging.warning(f"Using cached reservations fetched at {fetcher.cached_at()}")
+            return clean_court_names(cached)
+        prefetched = reservation_prefetcher.reservations_for(datetime.now().date()) if use_cache else None
+        if prefetched:
+            logging.warning("Using prefetched reservations for today")
+            return clean_court_names(prefetched)
+
         if attempt < max_retries - 1:
-            time.sleep(retry_delay)
+            with tracer.span('retry delay', seconds=retry_delay):
+                if exit_flag.wait(retry_delay):
+                    break
     return None
 
-def check_and_update_reservations():
+def apply_reservation_update(new_reservations, start_if_idle=True):
     global current_reservations
+    with reservations_lock:
+        if new_reservations == current_reservations:
+            logging.info("No changes in reservations")
+            return
+        changes = diff_reservations(current_reservations, new_reservations)
+        logging.info("Reservations have changed: " + "; ".join(
+            f"{kind} {', '.join(times)}" for kind, times in changes.items() if times))
+        current_reservations = new_reservations
+        runner = plan_runner
+        if runner is not None:
+            state_journal.record_reservations(runner.day, new_reservations)
+            event_store.record_plan(runner.day, planned_rows(explain_day(new_reservations, runner.day), device_targets))
+            patched = runner.replace(compile_day(new_reservations, runner.day))
+            logging.info(f"Updated the running lighting plan ({patched} upcoming transitions changed)")
+        elif start_if_idle and not daily_routine_lock.locked():
+            logging.info("No lighting plan is running. Starting the daily routine with the new reservations.")
+            scheduler.run_now('daily routine', new_reservations)
+
+def check_and_update_reservations():
     logging.info("Checking for updated reservations")
-    new_reservations = get_reservations_with_retry()
+    new_reservations = get_reservations_with_retry(use_cache=False)
     
     if new_reservations:
-        if new_reservations != current_reservations:
-            logging.info("Reservations have changed. Restarting the program.")
-            current_reservations = new_reservations
-            os.execv(sys.executable, ['python'] + sys.argv)
-        else:
-            logging.info("No changes in reservations")
+        apply_reservation_update(new_reservations)
     else:
         logging.error("Failed to fetch updated reservations")
 
+def on_prefetched(day, reservations):
+    # Background refreshes only patch today's running plan; the daily routine starts on schedule
+    runner = plan_runner
+    if runner is not None and runner.day == day:
+        apply_reservation_update(clean_court_names(reservations), start_if_idle=False)
+
+def journaled_reservations():
+    reservations = state_journal.reservations_for(datetime.now().date())
+    if not reservations:
+        return None
+    logging.info("Using today's reservations from the state journal")
+    return reservations
+
+def prefetched_reservations():
+    reservations = reservation_prefetcher.reservations_for(datetime.now().date())
+    if not reservations:
+        return None
+    logging.info("Using prefetched reservations for today")
+    return clean_court_names(reservations)
+
 def schedule_reservation_checks():
-    schedule.every().day.at("05:20").do(check_and_update_reservations)
-    schedule.every().day.at("06:20").do(check_and_update_reservations)
-    schedule.every().day.at("18:20").do(check_and_update_reservations)
-    schedule.every().day.at("19:20").do(check_and_update_reservations)
-    schedule.every().day.at("20:20").do(check_and_update_reservations)
-    schedule.every().day.at("21:20").do(check_and_update_reservations)
-
-def run_scheduled_checks():
-    while not exit_flag.is_set():
-        schedule.run_pending()
-        time.sleep(1)
-
-def daily_routine():
-    global current_reservations, daily_routine_running
-    if daily_routine_running:
+    # A check still retrying when the next one is due is followed by one more, so no change waits an hour
+    scheduler.daily('reservation check', ["05:20", "06:20", "18:20", "19:20", "20:20", "21:20"],
+                    check_and_update_reservations, overrun=QUEUE)
+
+@traced('daily_routine')
+def daily_routine(reservations=None):
+    global current_reservations
+    if not daily_routine_lock.acquire(blocking=False):
         logging.info("Daily routine is already running. Skipping.")
         return
 
-    daily_routine_running = True
     logging.info(f"Starting daily routine at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     try:
-        current_reservations = get_reservations_with_retry()
+        with tracer.span('load reservations'):
+            current_reservations = (reservations or journaled_reservations() or prefetched_reservations()
+                                    or get_reservations_with_retry())
         
         if current_reservations:
             logging.info("Reservations fetched:")
             for reservation_time, courts in current_reservations.items():
                 logging.info(f"Time: {reservation_time}, Courts: {', '.join(courts)}")
             
-            devices = setup_devices()
+            with tracer.span('setup_devices'):
+                devices = setup_devices()
             if not devices:
                 logging.error("Failed to set up devices. Exiting.")
                 return
@@ -310,44 +216,60 @@ def daily_routine():
         else:
             logging.error("Failed to fetch reservations. Skipping light control for today.")
     finally:
-        daily_routine_running = False
+        daily_routine_lock.release()
 
 def signal_handler(signum, frame):
     logging.info(f"Received signal {signum}. Exiting gracefully...")
     exit_flag.set()
+    scheduler.wake()
+    if plan_runner is not None:
+        plan_runner.wake()
     sys.exit(0)
 
+def profile_signal_handler(signum, frame):
+    # Written from a thread so the handler never waits on a lock the interrupted code holds
+    threading.Thread(target=tracer.toggle_profiling, name="profile").start()
+
 def main():
+    if os.path.exists(SITES_FILE):
+        # Several courts or venues: the asyncio engine runs every site from the sites file instead
+        logging.info(f"Found {SITES_FILE}. Starting the multi-site engine.")
+        from engine import run_engine
+        run_engine(SITES_FILE)
+        return
+
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, profile_signal_handler)
 
     logging.info("Starting the court lighting management system")
 
+    # Keep the coming days of reservations cached locally, fresh for the 04:10 start
+    reservation_prefetcher.on_update = on_prefetched
+    reservation_prefetcher.start()
+    scheduler.daily('prefetch refresh', ["04:00"], reservation_prefetcher.refresh_soon)
+
     # Schedule reservation checks
     schedule_reservation_checks()
     logging.info("Reservation checks scheduled")
 
-    # Start the thread for running scheduled checks
-    check_thread = threading.Thread(target=run_scheduled_checks)
-    check_thread.start()
-
-    # Run the daily routine immediately
-    daily_routine()
-    
-    # Schedule the daily routine to run at 4:10 AM every day
-    schedule.every().day.at("04:10").do(daily_routine)
+    # Schedule the daily routine to run at 4:10 AM every day, and run it immediately
+    scheduler.daily('daily routine', ["04:10"], daily_routine, overrun=SKIP)
     logging.info("Daily routine scheduled to run at 04:10 AM")
+    scheduler.run_now('daily routine')
 
     try:
-        while not exit_flag.is_set():
-            schedule.run_pending()
-            time.sleep(60)
+        scheduler.run()
     except Exception as e:
         logging.error(f"An error occurred in the main loop: {e}")
     finally:
         logging.info("Exiting the application...")
         exit_flag.set()
-        check_thread.join()
+        reservation_prefetcher.stop()
+        if plan_runner is not None:
+            plan_runner.wake()
+        scheduler.join()
 
 if __name__ == "__main__":
     main()
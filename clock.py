@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    max_wait = 60  # re-read the wall clock at least this often in case it is adjusted
+
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    async def sleep_async(self, seconds):
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def wait(self, event, timeout):
+        return event.wait(timeout)
+
+    def run_together(self, calls, executor):
+        # Runs the calls at the same time: all but the last on the executor, the last on this thread
+        futures = [executor.submit(call) for call in calls[:-1]]
+        last = calls[-1]() if calls else None
+        return [future.result() for future in futures] + ([last] if calls else [])
+
+
+class VirtualClock:
+    # Time only moves when somebody sleeps or waits, so a whole day runs instantly.
+    # Concurrent sleepers that start together finish together, as they would in real time.
+    max_wait = None
+
+    def __init__(self, start):
+        self.start = start
+        self.current = start
+        self.lock = threading.Lock()
+
+    def now(self):
+        with self.lock:
+            return self.current
+
+    def time(self):
+        return self.now().timestamp()
+
+    def monotonic(self):
+        return (self.now() - self.start).total_seconds()
+
+    def advance_to(self, moment):
+        with self.lock:
+            if moment > self.current:
+                self.current = moment
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance_to(self.now() + timedelta(seconds=seconds))
+
+    async def sleep_async(self, seconds):
+        self.sleep(seconds)
+        await asyncio.sleep(0)
+
+    def wait(self, event, timeout):
+        if event.is_set():
+            return True
+        self.sleep(timeout)
+        return event.is_set()
+
+    def run_together(self, calls, executor=None):
+        # No threads needed: each call runs from the same moment in turn, and the clock ends at the latest finish
+        start = self.now()
+        results, finished = [], start
+        for call in calls:
+            with self.lock:
+                self.current = start
+            results.append(call())
+            finished = max(finished, self.now())
+        self.advance_to(finished)
+        return results
+
+
+system_clock = SystemClock()
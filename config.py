@@ -7,6 +7,40 @@ load_dotenv()
 # Check if we're in production mode
 IS_PRODUCTION = os.getenv('IS_PRODUCTION', 'false').lower() == 'true'
 
+# Local state kept between runs (reservation cache and friends)
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+RESERVATION_CACHE_FILE = os.path.join(DATA_DIR, 'reservations.json')
+DEVICE_STATE_FILE = os.path.join(DATA_DIR, 'device_states.json')
+METRICS_FILE = os.path.join(DATA_DIR, 'metrics.json')
+DISCOVERY_CACHE_FILE = os.path.join(DATA_DIR, 'devices.json')
+JOURNAL_FILE = os.path.join(DATA_DIR, 'journal.jsonl')
+EVENTS_FILE = os.path.join(DATA_DIR, 'events.db')
+PROFILE_DIR = os.path.join(DATA_DIR, 'profiles')
+
+# Set to a file path to record timed spans of each daily routine in Chrome trace format
+TRACE_FILE = os.getenv('TRACE_FILE') or None
+
+# Seconds a confirmed light state is trusted before it is read back again
+STATE_FRESHNESS = float(os.getenv('STATE_FRESHNESS', '300'))
+
+# Log lines kept by web.py for /get_logs and the page: at most LOG_CAPACITY lines (21 bytes of index each)
+# and LOG_BUFFER_BYTES of text, kept in a ring file the kernel can page out
+LOG_CAPACITY = int(os.getenv('LOG_CAPACITY', '100000'))
+LOG_BUFFER_BYTES = int(os.getenv('LOG_BUFFER_BYTES', str(8 * 1024 * 1024)))
+LOG_RING_FILE = os.path.join(DATA_DIR, 'logs.ring')
+
+# Courts, devices and rule windows for every site run by engine.py; app.py hands over to it when present
+SITES_FILE = os.getenv('SITES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sites.json'))
+
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '5'))
+API_READ_TIMEOUT = float(os.getenv('API_READ_TIMEOUT', '20'))
+
+# Days of reservations fetched ahead; off by default, as only an API that honours API_DATE_PARAM can serve them
+PREFETCH_DAYS = int(os.getenv('PREFETCH_DAYS', '0'))
+PREFETCH_INTERVAL = float(os.getenv('PREFETCH_INTERVAL', '3600'))
+PREFETCH_DIR = os.path.join(DATA_DIR, 'reservations')
+API_DATE_PARAM = os.getenv('API_DATE_PARAM', 'date')
+
 if IS_PRODUCTION:
     API_URL = os.getenv('API_URL')
     
@@ -28,22 +62,22 @@ if IS_PRODUCTION:
         }
     }
 
+    _device_pool = None
+
+    def get_device_pool():
+        # Sessions stay open across daily runs and are shared by every caller
+        global _device_pool
+        if _device_pool is None:
+            from device_pool import DevicePool
+            from discovery import DeviceDiscovery
+            _device_pool = DevicePool(DEVICES, discovery=DeviceDiscovery()).start()
+        return _device_pool
+
     def setup_devices():
-        import tinytuya
         devices = {}
-        for court, info in DEVICES.items():
-            try:
-                device = tinytuya.BulbDevice(
-                    dev_id=info['id'],
-                    address=info['ip'],
-                    local_key=info['key'],
-                    version=3.4
-                )
-                device.set_version(3.4)
-                devices[court] = device
-                print(f"Device set up for {court}")
-            except Exception as e:
-                print(f"Error setting up device for {court}: {e}")
+        for court, device in get_device_pool().devices.items():
+            devices[court] = device
+            print(f"Device set up for {court}")
         return devices
 
     def check_device_status(device, expected_state):
@@ -0,0 +1,128 @@
+import logging
+import threading
+from collections import defaultdict, deque
+
+from clock import system_clock
+from config import check_device_status
+from tracing import tracer
+
+HISTORY_SIZE = 50          # confirmation latencies remembered per device
+FIRST_POLL = 0.3           # seconds before the first read-back when nothing is known yet
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2.0
+BACKOFF_FACTOR = 2.0
+DEFAULT_TIMEOUT = 15.0
+MIN_TIMEOUT = 3.0
+MAX_TIMEOUT = 30.0
+TIMEOUT_MARGIN = 3.0       # timeout = TIMEOUT_MARGIN x p95 of recent confirmations
+
+
+class LatencyHistogram:
+    def __init__(self, size=HISTORY_SIZE):
+        self.samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class LatencyTracker:
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.histograms = defaultdict(lambda: LatencyHistogram(self.size))
+        self.lock = threading.Lock()
+
+    def record(self, light, seconds):
+        with self.lock:
+            self.histograms[light].record(seconds)
+
+    def poll_plan(self, light):
+        # Returns (first poll delay, timeout) tuned from the device's recent history
+        with self.lock:
+            histogram = self.histograms[light]
+            if not histogram:
+                return FIRST_POLL, DEFAULT_TIMEOUT
+            p50 = histogram.percentile(50)
+            p95 = histogram.percentile(95)
+        first_poll = max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, p50 * 0.8))
+        timeout = max(MIN_TIMEOUT, min(MAX_TIMEOUT, p95 * TIMEOUT_MARGIN))
+        return first_poll, timeout
+
+
+latency_tracker = LatencyTracker()
+
+
+def _poll_delays(sent_at, first_poll, timeout, clock):
+    # Bounded exponential backoff: yields the wait before each status read until the deadline passes
+    deadline = sent_at + timeout
+    interval = first_poll
+    next_poll = sent_at + first_poll
+    while True:
+        yield max(0.0, min(next_poll, deadline) - clock.monotonic())
+        now = clock.monotonic()
+        if now >= deadline:
+            return
+        interval = max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, interval * BACKOFF_FACTOR))
+        next_poll = now + interval
+
+
+def _read_state(device, light, expected_state):
+    with tracer.span('status poll', light=light):
+        return check_device_status(device, expected_state) is True
+
+
+def _timed_out(light, expected_state, timeout, sent_at, last_error, clock):
+    if last_error is not None:
+        logging.error(f"Error checking {light} light status: {last_error}")
+    logging.warning(f"{light} light did not reach {'on' if expected_state else 'off'} within {timeout:.1f}s")
+    return False, clock.monotonic() - sent_at
+
+
+def wait_for_state(device, light, expected_state, sent_at=None, tracker=None, clock=system_clock):
+    # Poll with bounded exponential backoff until the device reports expected_state.
+    # Returns (confirmed, seconds since the command was sent).
+    tracker = tracker or latency_tracker
+    sent_at = sent_at if sent_at is not None else clock.monotonic()
+    first_poll, timeout = tracker.poll_plan(light)
+    last_error = None
+    for delay in _poll_delays(sent_at, first_poll, timeout, clock):
+        clock.sleep(delay)
+        try:
+            matched = _read_state(device, light, expected_state)
+        except Exception as e:
+            last_error = e
+            continue
+        if matched:
+            elapsed = clock.monotonic() - sent_at
+            tracker.record(light, elapsed)
+            return True, elapsed
+    return _timed_out(light, expected_state, timeout, sent_at, last_error, clock)
+
+
+async def wait_for_state_async(device, light, expected_state, sent_at, io, tracker=None, clock=system_clock):
+    # The same polling on an event loop: only the status reads go through io (a thread pool),
+    # the waits between them are awaited and hold no thread
+    tracker = tracker or latency_tracker
+    first_poll, timeout = tracker.poll_plan(light)
+    last_error = None
+    for delay in _poll_delays(sent_at, first_poll, timeout, clock):
+        await clock.sleep_async(delay)
+        try:
+            matched = await io(_read_state, device, light, expected_state)
+        except Exception as e:
+            last_error = e
+            continue
+        if matched:
+            elapsed = clock.monotonic() - sent_at
+            tracker.record(light, elapsed)
+            return True, elapsed
+    return _timed_out(light, expected_state, timeout, sent_at, last_error, clock)
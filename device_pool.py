@@ -0,0 +1,136 @@
+import logging
+import threading
+import time
+
+TUYA_VERSION = 3.4
+HEARTBEAT_INTERVAL = 10   # seconds between keep-alives on an open session
+# Close sessions nobody has used for this long. It covers the longest normal gap between transitions
+# (the 10-hour daytime off period), so the next transition never pays for a new handshake.
+IDLE_TIMEOUT = 12 * 3600
+
+
+def connect_tuya_device(info, timeout=None):
+    import tinytuya
+    device = tinytuya.BulbDevice(
+        dev_id=info['id'],
+        address=info['ip'],
+        local_key=info['key'],
+        version=info.get('version', TUYA_VERSION)
+    )
+    device.set_version(info.get('version', TUYA_VERSION))
+    device.set_socketPersistent(True)
+    if timeout is not None:
+        device.set_socketTimeout(timeout)
+        device.set_socketRetryLimit(1)
+    return device
+
+
+class DeviceError(Exception):
+    pass
+
+
+class PooledDevice:
+    def __init__(self, name, info, connect, discovery=None):
+        self.name = name
+        self.info = info
+        self.connect = connect
+        self.discovery = discovery
+        self.address = info.get('ip')
+        self.device = None
+        self.last_used = 0.0
+        self.lock = threading.Lock()
+
+    def _session(self):
+        if self.device is None:
+            info = self.discovery.resolve(self.name, self.info) if self.discovery else self.info
+            self.address = info.get('ip')
+            self.device = self.connect(info)
+            logging.info(f"Opened session to {self.name} at {self.address}")
+        return self.device
+
+    def _drop(self):
+        if self.device is not None:
+            try:
+                self.device.close()
+            except Exception:
+                pass
+            self.device = None
+
+    def _call(self, operation):
+        with self.lock:
+            error = None
+            # A failed call usually means the session went stale: reconnect once and retry
+            for attempt in range(2):
+                try:
+                    result = getattr(self._session(), operation)()
+                except Exception as e:
+                    error = e
+                else:
+                    if isinstance(result, dict) and 'Error' in result:
+                        error = DeviceError(result['Error'])
+                    else:
+                        self.last_used = time.monotonic()
+                        return result
+                self._drop()
+            if self.discovery is not None:
+                self.discovery.address_failed(self.name, self.info)
+            raise error
+
+    def turn_on(self):
+        return self._call('turn_on')
+
+    def turn_off(self):
+        return self._call('turn_off')
+
+    def status(self):
+        return self._call('status')
+
+    def maintain(self, idle_timeout):
+        if not self.lock.acquire(blocking=False):
+            return  # busy with a command, so the session is clearly alive
+        try:
+            if self.device is None:
+                return
+            if time.monotonic() - self.last_used > idle_timeout:
+                logging.info(f"Closing idle session to {self.name}")
+                self._drop()
+                return
+            try:
+                self.device.heartbeat()
+            except Exception as e:
+                logging.warning(f"Heartbeat to {self.name} failed, reconnecting on next use: {e}")
+                self._drop()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        with self.lock:
+            self._drop()
+
+
+class DevicePool:
+    def __init__(self, devices_info, connect=connect_tuya_device, discovery=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, idle_timeout=IDLE_TIMEOUT):
+        self.devices = {
+            name: PooledDevice(name, info, connect, discovery) for name, info in devices_info.items()
+        }
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._maintain, name="device-pool", daemon=True)
+            self.thread.start()
+        return self
+
+    def _maintain(self):
+        while not self.stop_event.wait(self.heartbeat_interval):
+            for device in self.devices.values():
+                device.maintain(self.idle_timeout)
+
+    def close(self):
+        self.stop_event.set()
+        for device in self.devices.values():
+            device.close()
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+
+from config import DISCOVERY_CACHE_FILE
+from storage import read_json, write_json_atomic
+
+SCAN_RETRIES = 10       # tinytuya broadcast listening rounds per scan
+RESCAN_INTERVAL = 300   # never rescan more often than this, in seconds
+
+
+def scan_network():
+    import tinytuya
+    found = {}
+    for entry in tinytuya.deviceScan(False, SCAN_RETRIES).values():
+        dev_id = entry.get('gwId') or entry.get('id')
+        if dev_id and entry.get('ip'):
+            found[dev_id] = {'ip': entry['ip'], 'version': entry.get('version')}
+    return found
+
+
+class DeviceDiscovery:
+    def __init__(self, path=DISCOVERY_CACHE_FILE, scan=scan_network):
+        self.path = path
+        self.scan = scan
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.addresses = read_json(path) or {}
+        self.scanning = None
+        self.last_scan = -RESCAN_INTERVAL
+
+    def resolve(self, name, info):
+        # Fill in the address of an 'Auto' device from the cache, scanning only if it was never seen
+        if info.get('ip') not in (None, '', 'Auto'):
+            return info
+        cached = self.addresses.get(info['id'])
+        if cached is None:
+            requested = time.monotonic()
+            with self.scan_lock:
+                # Devices resolving at the same time share one scan
+                if self.last_scan < requested and requested - self.last_scan >= RESCAN_INTERVAL:
+                    logging.info(f"No cached address for {name}; scanning the network")
+                    self._scan()
+            cached = self.addresses.get(info['id'])
+            if cached is None:
+                logging.warning(f"{name} was not found on the network; falling back to tinytuya discovery")
+                return info
+        resolved = dict(info, ip=cached['ip'])
+        if cached.get('version'):
+            resolved['version'] = float(cached['version'])
+        return resolved
+
+    def address_failed(self, name, info):
+        # A cached address stopped answering: look for the device again without blocking the caller
+        if info.get('ip') not in (None, '', 'Auto') or info['id'] not in self.addresses:
+            return
+        if time.monotonic() - self.last_scan < RESCAN_INTERVAL:
+            return
+        logging.info(f"{name} is not answering at {self.addresses[info['id']]['ip']}; rescanning in the background")
+        self.rescan_in_background()
+
+    def rescan_in_background(self):
+        with self.lock:
+            if self.scanning is not None and self.scanning.is_alive():
+                return
+            self.scanning = threading.Thread(target=self.rescan, name="discovery", daemon=True)
+            self.scanning.start()
+
+    def rescan(self):
+        with self.scan_lock:
+            self._scan()
+
+    def _scan(self):
+        self.last_scan = time.monotonic()
+        try:
+            found = self.scan()
+        except Exception as e:
+            logging.error(f"Device scan failed: {e}")
+            return
+        with self.lock:
+            for dev_id, entry in found.items():
+                self.addresses[dev_id] = dict(entry, seen=time.time())
+            try:
+                write_json_atomic(self.path, self.addresses)
+            except OSError as e:
+                logging.warning(f"Could not write discovery cache: {e}")
+        logging.info(f"Device scan found {len(found)} device(s)")
@@ -0,0 +1,309 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+import requests
+
+from actuation import MAX_ATTEMPTS, actuate_light_async, report_results
+from clock import system_clock
+from config import DATA_DIR, IS_PRODUCTION, SITES_FILE
+from device_pool import DevicePool
+from discovery import DeviceDiscovery
+from events import event_store, planned_rows
+from fetcher import ReservationFetcher, create_session
+from journal import StateJournal
+from state_cache import state_cache as device_state_cache
+from timeline import PlanRunner, SiteRules, clean_court_names, compile_day, explain_day
+
+IO_WORKERS = 16           # threads shared by every blocking device and API call, whatever the device count
+REFRESH_MINUTES = 60      # default minutes between reservation refreshes per site
+DAY_START = time(4, 10)   # when the next day's plan is loaded, as in app.py
+
+
+SiteLayout = namedtuple('SiteLayout', ['name', 'spec', 'lights', 'court_lights', 'rules'])
+
+
+def slug(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+def reservations_file(name):
+    return os.path.join(DATA_DIR, 'sites', f"{slug(name)}.json")
+
+
+def journal_file(name):
+    return os.path.join(DATA_DIR, 'sites', f"{slug(name)}.journal.jsonl")
+
+
+def describe_lights(state):
+    return ', '.join(sorted(state)) if state else 'all off'
+
+
+def _window(value):
+    if value is None:
+        return None
+    start, end = (datetime.strptime(at, '%H:%M').time() for at in value)
+    return start, end
+
+
+def load_rules(spec, court_lights, lights):
+    # Rule windows use the same defaults as the single-court timeline; states are sets of lit lights
+    kwargs = {}
+    for key, name in (('slot_minutes', 'slot_length'), ('early_activation_minutes', 'early_activation'),
+                      ('closing_all_on_minutes', 'closing_all_on'), ('closing_minutes', 'closing_full_only')):
+        if key in spec:
+            kwargs[name] = timedelta(minutes=spec[key])
+    for key in ('weekend_morning', 'off_period', 'all_on_period'):
+        if key in spec:
+            kwargs[key] = _window(spec[key])
+    closing_lights = frozenset(spec.get('closing_lights', ()))
+    if not closing_lights <= lights:
+        raise ValueError(f"closing_lights names unknown lights: {', '.join(sorted(closing_lights - lights))}")
+
+    def state_for_courts(courts):
+        lit = set()
+        for court in courts:
+            lit.update(court_lights.get(court, ()))
+        return frozenset(lit)
+
+    return SiteRules(state_for_courts=state_for_courts, all_on=frozenset(lights), all_off=frozenset(),
+                     closing_state=closing_lights, **kwargs)
+
+
+class MockLight:
+    def __init__(self, name):
+        self.name = name
+        self.state = False
+
+    def turn_on(self):
+        self.state = True
+        print(f"{self.name} light turned ON")
+
+    def turn_off(self):
+        self.state = False
+        print(f"{self.name} light turned OFF")
+
+    def status(self):
+        return {'dps': {'1': self.state}}
+
+
+class Site:
+    # One venue: its reservations and rules, driven by the shared PlanRunner, actuation and bookkeeping
+    def __init__(self, name, url, rules, court_lights, devices, refresh, session, clock=system_clock,
+                 state_cache=device_state_cache, journal=None, events=event_store):
+        self.name = name
+        self.rules = rules
+        self.court_lights = court_lights
+        self.devices = devices
+        self.refresh = refresh
+        self.clock = clock
+        self.state_cache = state_cache
+        self.journal = journal or StateJournal(path=journal_file(name), clock=clock)
+        self.events = events
+        self.fetcher = ReservationFetcher(url=url, cache_file=reservations_file(name), session=session)
+        self.reservations = None
+        self.day = None
+        self.plan = ()
+        self.runner = None
+
+    def log(self, level, message):
+        logging.log(level, f"[{self.name}] {message}")
+
+    def targets(self, state):
+        return [(light, light in state) for light in sorted(self.devices)]
+
+    def _fetch(self, day):
+        try:
+            return self.fetcher.fetch()
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.log(logging.ERROR, f"Error fetching reservations: {e}")
+        cached = self.fetcher.cached_reservations(day)
+        if cached is not None:
+            self.log(logging.WARNING, f"Using cached reservations fetched at {self.fetcher.cached_at()}")
+        return cached
+
+    def _record_plan(self, day, reservations):
+        self.journal.record_reservations(day, reservations)
+        self.events.record_plan(day, planned_rows(explain_day(reservations, day, self.rules), self.targets),
+                                self.name)
+
+    async def load(self, engine, day, refresh=False):
+        reservations = await engine.io(self._fetch, day)
+        if reservations is None:
+            return False
+        if refresh and self.clock.now().date() != day:
+            return True  # the fetch ran past midnight
+        reservations = clean_court_names(reservations)
+        if reservations == self.reservations and day == self.day:
+            return True
+        unknown = {court for courts in reservations.values() for court in courts} - set(self.court_lights)
+        if unknown:
+            self.log(logging.WARNING, f"Ignoring reservations for unknown courts: {', '.join(sorted(unknown))}")
+        plan = compile_day(reservations, day, self.rules)
+        self.log(logging.INFO, f"Compiled {len(plan)} light transitions for {day.strftime('%Y-%m-%d')}")
+        self.reservations, self.day, self.plan = reservations, day, plan
+        await engine.io(self._record_plan, day, reservations)
+        runner = self.runner
+        if runner is not None and runner.day == day:
+            patched = runner.replace(plan)
+            self.log(logging.INFO, f"Updated the running lighting plan ({patched} upcoming transitions changed)")
+        return True
+
+    async def run(self, engine):
+        while True:
+            day = self.clock.now().date()
+            if not await self.load(engine, day):
+                self.log(logging.ERROR, f"No reservations for {day}; retrying in {self.refresh:.0f}s")
+                await asyncio.sleep(self.refresh)
+                continue
+
+            # After a restart the journal tells us whether the lights already match the current transition
+            resume = self.journal.resume_point(day, self.plan, self.targets)
+            if resume is not None:
+                self.log(logging.INFO, f"Resuming from the state journal: {describe_lights(resume.state)} since "
+                                       f"{resume.at.strftime('%H:%M')} is already confirmed, no commands needed")
+            self.runner = PlanRunner(self.plan, day, lambda state: self.apply(engine, state), engine.stop,
+                                     self.clock, resume_from=resume,
+                                     on_applied=lambda transition: engine.io(self.journal.record_applied, day,
+                                                                             transition),
+                                     site=self.name, describe=describe_lights)
+            refresher = asyncio.ensure_future(self.keep_fresh(engine, day))
+            try:
+                if not await self.runner.run_async():
+                    return
+            finally:
+                refresher.cancel()
+                self.runner = None
+            next_start = datetime.combine(day + timedelta(days=1), DAY_START)
+            self.log(logging.INFO, f"Plan finished; next plan at {next_start.strftime('%Y-%m-%d %H:%M')}")
+            await self.sleep_until(next_start)
+
+    async def keep_fresh(self, engine, day):
+        # The site API has no date, so after midnight it returns the next day's bookings; stop refreshing then
+        while True:
+            await asyncio.sleep(self.refresh)
+            if self.clock.now().date() != day:
+                return
+            await self.load(engine, day, refresh=True)
+
+    async def sleep_until(self, moment):
+        while True:
+            remaining = (moment - self.clock.now()).total_seconds()
+            if remaining <= 0:
+                return
+            # Re-read the wall clock now and then in case it is adjusted
+            await asyncio.sleep(min(remaining, self.clock.max_wait or remaining))
+
+    async def apply(self, engine, state):
+        # The single-court actuation with awaited confirmation: a light only holds an I/O thread during a device call
+        results = await asyncio.gather(*(
+            actuate_light_async(self.devices, light, target, engine.io, MAX_ATTEMPTS, self.state_cache, self.clock,
+                                self.name)
+            for light, target in self.targets(state)))
+        await engine.io(report_results, results, self.journal, self.events)
+        return all(result.confirmed for result in results)
+
+
+class Engine:
+    # All sites share one event loop; blocking tinytuya and HTTP calls go to a small bounded thread pool
+    def __init__(self, sites, executor, pool=None):
+        self.sites = sites
+        self.executor = executor
+        self.pool = pool
+        self.stop = threading.Event()
+
+    def io(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def run(self):
+        tasks = [asyncio.ensure_future(site.run(self)) for site in self.sites]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.stop.set()
+            for task in tasks:
+                task.cancel()
+
+
+def read_sites(path=SITES_FILE):
+    # The sites in a sites file with their lights, court lights and rules, checked but without devices
+    with open(path) as f:
+        spec = json.load(f)
+    sites_spec = spec.get('sites') or []
+    if not sites_spec:
+        raise ValueError(f"{path} defines no sites")
+    layouts = []
+    for site_spec in sites_spec:
+        name = site_spec['name']
+        lights = frozenset(site_spec['devices'])
+        court_lights = {court: frozenset(names) for court, names in site_spec['courts'].items()}
+        for court, names in court_lights.items():
+            if not names <= lights:
+                raise ValueError(f"{name}: court {court} uses unknown lights: {', '.join(sorted(names - lights))}")
+        rules = load_rules(site_spec.get('rules', {}), court_lights, lights)
+        layouts.append(SiteLayout(name, site_spec, lights, court_lights, rules))
+    return layouts
+
+
+def load_sites(path=SITES_FILE, clock=system_clock):
+    layouts = read_sites(path)
+    session = create_session(pool_size=len(layouts))
+    discovery = DeviceDiscovery() if IS_PRODUCTION else None
+    pooled = {}
+    sites = []
+    for name, site_spec, lights, court_lights, rules in layouts:
+        if IS_PRODUCTION:
+            pooled.update({f"{name}/{light}": info for light, info in site_spec['devices'].items()})
+            devices = {light: f"{name}/{light}" for light in lights}
+        else:
+            devices = {light: MockLight(f"{name} {light}") for light in lights}
+        refresh = 60.0 * site_spec.get('refresh_minutes', REFRESH_MINUTES)
+        sites.append(Site(name, site_spec['api_url'], rules, court_lights, devices, refresh, session, clock))
+
+    pool = None
+    if pooled:
+        pool = DevicePool(pooled, discovery=discovery).start()
+        for site in sites:
+            site.devices = {light: pool.devices[key] for light, key in site.devices.items()}
+    return sites, pool
+
+
+def run_engine(path=SITES_FILE, workers=IO_WORKERS):
+    sites, pool = load_sites(path)
+    logging.info(f"Running {len(sites)} site(s) with {sum(len(site.devices) for site in sites)} lights "
+                 f"on {workers} I/O threads")
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="engine-io")
+    loop = asyncio.new_event_loop()
+    main_task = loop.create_task(Engine(sites, executor, pool).run())
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, main_task.cancel)
+    try:
+        loop.run_until_complete(main_task)
+    except asyncio.CancelledError:
+        logging.info("Stop requested. Leaving the lighting plans.")
+    finally:
+        loop.close()
+        executor.shutdown(wait=False)
+        if pool is not None:
+            pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the lighting plans of every site in a sites file")
+    parser.add_argument('--config', default=SITES_FILE, help="sites file (default: SITES_FILE)")
+    parser.add_argument('--workers', type=int, default=IO_WORKERS, help="threads for blocking device and API calls")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    run_engine(args.config, args.workers)
+
+
+if __name__ == '__main__':
+    main()
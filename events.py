@@ -0,0 +1,98 @@
+import logging
+import os
+import sqlite3
+import threading
+
+from clock import system_clock
+from config import EVENTS_FILE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS light_events (
+    ts REAL NOT NULL,            -- unix time the state was confirmed
+    site TEXT NOT NULL,          -- '' for the single-court app
+    light TEXT NOT NULL,
+    state INTEGER NOT NULL,      -- 1 on, 0 off
+    commands INTEGER NOT NULL    -- commands sent; 0 when the light was already in the state
+);
+CREATE INDEX IF NOT EXISTS light_events_ts ON light_events (ts);
+CREATE TABLE IF NOT EXISTS planned_light (
+    day TEXT NOT NULL,
+    site TEXT NOT NULL,
+    light TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    rule TEXT NOT NULL           -- reservation, all-on period, closing, ...
+);
+CREATE INDEX IF NOT EXISTS planned_light_day ON planned_light (site, day);
+CREATE INDEX IF NOT EXISTS planned_light_start ON planned_light (start);
+"""
+
+
+def rule_of(reason):
+    # Plan reasons carry details ("reservation 18:30-20:30 for ..."); only the rule itself is stored
+    if reason.startswith('reservation'):
+        return 'reservation'
+    if reason.startswith('closing'):
+        return 'closing'
+    return reason
+
+
+def planned_rows(explained, targets):
+    # (light, start, end, rule) for every stretch of an explained plan during which a light should be lit
+    rows = []
+    for current, following in zip(explained, explained[1:]):
+        for light, on in targets(current.state):
+            if on:
+                rows.append((light, current.at.timestamp(), following.at.timestamp(), rule_of(current.reason)))
+    return rows
+
+
+def connect(path=EVENTS_FILE, readonly=False):
+    if readonly:
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class EventStore:
+    def __init__(self, path=EVENTS_FILE, clock=system_clock):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def _write(self, statements):
+        if not self.path:
+            return
+        with self.lock:
+            try:
+                if self.connection is None:
+                    self.connection = connect(self.path)
+                with self.connection:
+                    for sql, rows in statements:
+                        self.connection.executemany(sql, rows)
+            except sqlite3.Error as e:
+                logging.warning(f"Could not write to the event store: {e}")
+
+    def record(self, events, site=''):
+        # events: (light, state, commands) confirmed together by one transition
+        if not events:
+            return
+        now = self.clock.time()
+        self._write([("INSERT INTO light_events (ts, site, light, state, commands) VALUES (?, ?, ?, ?, ?)",
+                      [(now, site, light, int(state), commands) for light, state, commands in events])])
+
+    def record_plan(self, day, rows, site=''):
+        # Replaces the day's planned stretches, so a recompiled plan is reflected as a whole
+        day = day.strftime('%Y-%m-%d')
+        self._write([
+            ("DELETE FROM planned_light WHERE site = ? AND day = ?", [(site, day)]),
+            ("INSERT INTO planned_light (day, site, light, start, end, rule) VALUES (?, ?, ?, ?, ?, ?)",
+             [(day, site, light, start, end, rule) for light, start, end, rule in rows]),
+        ])
+
+
+event_store = EventStore()
@@ -0,0 +1,88 @@
+import logging
+import time
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import API_CONNECT_TIMEOUT, API_READ_TIMEOUT, API_URL, RESERVATION_CACHE_FILE
+from metrics import metrics
+from storage import read_json, write_json_atomic
+
+HEADERS = {
+    "Accept": "application/json",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+
+def create_session(pool_size=4):
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ReservationFetcher:
+    def __init__(self, url=API_URL, cache_file=RESERVATION_CACHE_FILE,
+                 connect_timeout=API_CONNECT_TIMEOUT, read_timeout=API_READ_TIMEOUT, session=None):
+        self.url = url
+        self.cache_file = cache_file
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = session or create_session()
+        self.cache = read_json(cache_file) if cache_file else None
+
+    def fetch(self):
+        headers = {}
+        if self.cache:
+            if self.cache.get('etag'):
+                headers['If-None-Match'] = self.cache['etag']
+            if self.cache.get('last_modified'):
+                headers['If-Modified-Since'] = self.cache['last_modified']
+
+        started = time.monotonic()
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            metrics.inc('reservation_fetch_total', {'status': 'error'})
+            raise
+        finally:
+            metrics.observe('reservation_fetch_seconds', time.monotonic() - started)
+        metrics.inc('reservation_fetch_total', {'status': str(response.status_code)})
+        metrics.inc('reservation_fetch_bytes_total', value=len(response.content))
+
+        if response.status_code == 304 and self.cache:
+            logging.info("Reservations not modified since last fetch")
+            self._store(self.cache['payload'], self.cache.get('etag'), self.cache.get('last_modified'))
+            return self.cache['payload']['reservations']
+
+        response.raise_for_status()
+        data = response.json()
+        reservations = data['reservations']
+        self._store(data, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return reservations
+
+    def _store(self, payload, etag, last_modified):
+        now = datetime.now()
+        self.cache = {
+            'date': now.strftime('%Y-%m-%d'),
+            'fetched_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'etag': etag,
+            'last_modified': last_modified,
+            'payload': payload,
+        }
+        if self.cache_file:
+            try:
+                write_json_atomic(self.cache_file, self.cache)
+            except OSError as e:
+                logging.warning(f"Could not write reservation cache: {e}")
+
+    def cached_reservations(self, day):
+        # Only a payload fetched on the same day describes that day's bookings
+        if self.cache and self.cache.get('date') == day.strftime('%Y-%m-%d'):
+            return self.cache['payload'].get('reservations')
+        return None
+
+    def cached_at(self):
+        return self.cache.get('fetched_at') if self.cache else None
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+from clock import system_clock
+from config import JOURNAL_FILE, STATE_FRESHNESS
+
+COMPACT_AFTER = 500  # records appended before the journal is rewritten as a single snapshot
+
+
+def encode_state(state):
+    # Court states are tuples in a fixed order; a site's states are sets of lit lights, stored sorted
+    return sorted(state) if isinstance(state, (set, frozenset)) else list(state)
+
+
+def empty_snapshot():
+    return {'day': None, 'reservations': None, 'applied': None, 'lights': {}}
+
+
+def replay(snapshot, record):
+    kind = record.get('type')
+    if kind == 'snapshot':
+        snapshot.update({key: record[key] for key in empty_snapshot()})
+    elif kind == 'reservations':
+        if record['day'] != snapshot['day']:
+            snapshot.update(empty_snapshot())
+        snapshot['day'] = record['day']
+        snapshot['reservations'] = record['reservations']
+    elif kind == 'applied' and record['day'] == snapshot['day']:
+        snapshot['applied'] = {'at': record['at'], 'state': record['state'], 'time': record['time']}
+    elif kind == 'light':
+        snapshot['lights'][record['light']] = {'state': record['state'], 'time': record['time']}
+
+
+def load_journal(path=JOURNAL_FILE):
+    # Returns the replayed snapshot and whether the file ended in a torn or unreadable record
+    snapshot = empty_snapshot()
+    try:
+        with open(path) as f:
+            lines = f.read().split('\n')
+    except FileNotFoundError:
+        return snapshot, False
+    except OSError as e:
+        logging.warning(f"Ignoring unreadable journal {path}: {e}")
+        return snapshot, True
+    torn = bool(lines[-1])  # every complete record ends with a newline
+    for line in lines[:-1]:
+        if not line:
+            continue
+        try:
+            replay(snapshot, json.loads(line))
+        except (ValueError, KeyError, TypeError):
+            torn = True
+            break
+    return snapshot, torn
+
+
+class StateJournal:
+    def __init__(self, path=JOURNAL_FILE, freshness=STATE_FRESHNESS, clock=system_clock):
+        self.path = path
+        self.freshness = freshness
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.appended = 0
+        if path:
+            self.snapshot, torn = load_journal(path)
+            if torn:
+                logging.warning("State journal ended in a partial record; rewriting it")
+                self._compact()
+        else:
+            self.snapshot = empty_snapshot()
+
+    def record_reservations(self, day, reservations):
+        day = day.strftime('%Y-%m-%d')
+        with self.lock:
+            if self.snapshot['day'] == day and self.snapshot['reservations'] == reservations:
+                return
+            new_day = self.snapshot['day'] != day
+            self._append({'type': 'reservations', 'day': day, 'reservations': reservations})
+            if new_day:
+                self._compact()
+
+    def record_applied(self, day, transition):
+        with self.lock:
+            self._append({'type': 'applied', 'day': day.strftime('%Y-%m-%d'),
+                          'at': transition.at.isoformat(), 'state': encode_state(transition.state),
+                          'time': self.clock.time()})
+
+    def record_light(self, light, state):
+        with self.lock:
+            self._append({'type': 'light', 'light': light, 'state': state, 'time': self.clock.time()})
+
+    def reservations_for(self, day):
+        with self.lock:
+            if self.snapshot['day'] != day.strftime('%Y-%m-%d'):
+                return None
+            return self.snapshot['reservations']
+
+    def resume_point(self, day, plan, targets):
+        # The transition still in force if it was fully applied recently and every light confirmed it since
+        moment = self.clock.now()
+        with self.lock:
+            applied = self.snapshot['applied']
+            lights = dict(self.snapshot['lights'])
+            if self.snapshot['day'] != day.strftime('%Y-%m-%d') or applied is None:
+                return None
+        if self.clock.time() - applied['time'] > self.freshness:
+            return None
+        current = None
+        for transition in plan:
+            if transition.at > moment:
+                break
+            current = transition
+        if (current is None or current.at.isoformat() != applied['at']
+                or encode_state(current.state) != applied['state']):
+            return None
+        for light, target in targets(current.state):
+            entry = lights.get(light)
+            if entry is None or entry['state'] != target or entry['time'] < applied['time'] - self.freshness:
+                return None
+        return current
+
+    def _append(self, record):
+        replay(self.snapshot, record)
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            logging.warning(f"Could not append to state journal: {e}")
+            return
+        self.appended += 1
+        if self.appended >= COMPACT_AFTER:
+            self._compact()
+
+    def _compact(self):
+        if not self.path:
+            return
+        record = dict(self.snapshot, type='snapshot',
+                      written=datetime.fromtimestamp(self.clock.time()).strftime('%Y-%m-%d %H:%M:%S'))
+        tmp_path = f"{self.path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.warning(f"Could not rewrite state journal: {e}")
+            return
+        self.appended = 0
+
+
+state_journal = StateJournal()
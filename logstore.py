@@ -0,0 +1,191 @@
+import logging
+import mmap
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+from config import LOG_BUFFER_BYTES, LOG_CAPACITY, LOG_RING_FILE
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+LINE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?:,(\d{3}))? - ([A-Z]+) - ')
+COURT_PATTERN = re.compile(r'\b(Half Court [A-Z]|Full Court|Court \d+)\b')
+MAX_LINE_BYTES = 16384  # longer lines are cut, so one line never takes over the ring
+
+
+def parse_line(line):
+    # (timestamp, level index, courts); timestamp and level are None for prints and tracebacks
+    match = LINE_PATTERN.match(line)
+    moment = level = None
+    if match:
+        moment = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").timestamp()
+        moment += int(match.group(2) or 0) / 1000.0
+        if match.group(3) in LEVELS:
+            level = LEVELS.index(match.group(3))
+    return moment, level, sorted(set(COURT_PATTERN.findall(line)))
+
+
+def open_ring(path, size):
+    # A file-backed mapping is page cache the kernel can write out and reclaim, not memory of the process
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'w+b') as f:
+                f.truncate(size)
+                return mmap.mmap(f.fileno(), size)
+        except OSError as e:
+            logging.warning(f"Could not map log ring file {path}, keeping log text in memory: {e}")
+    return mmap.mmap(-1, size)
+
+
+class _TimeView:
+    # The ring's timestamps in sequence order, so bisect can search them
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return self.store.size
+
+    def __getitem__(self, position):
+        return self.store.times[(self.store.first - 1 + position) % self.store.capacity]
+
+
+class LogStore:
+    # A ring of log lines: utf-8 text in a fixed-size byte ring, times, levels and text offsets in flat arrays,
+    # and per-level and per-court sequence indexes. The oldest lines go when either ring is full.
+    def __init__(self, capacity=LOG_CAPACITY, path=LOG_RING_FILE, buffer_bytes=LOG_BUFFER_BYTES):
+        self.capacity = capacity
+        self.buffer_bytes = buffer_bytes
+        self.text = open_ring(path, buffer_bytes)
+        self.written = 0                # text bytes ever appended; a line starts at its offset modulo the ring size
+        self.times = array('d', bytes(8 * capacity))
+        self.levels = array('b', bytes(capacity))
+        self.offsets = array('q', bytes(8 * capacity))
+        self.last = 0                   # sequence number of the newest line; the first line is 1
+        self.size = 0
+        self.by_level = [array('q') for _ in LEVELS]
+        self.by_court = {}
+        self.lock = threading.Lock()
+        self.added = threading.Condition(self.lock)
+
+    @property
+    def first(self):
+        return self.last - self.size + 1
+
+    def append(self, line):
+        moment, level, courts = parse_line(line)
+        data = line.encode('utf-8')[:min(MAX_LINE_BYTES, self.buffer_bytes)]
+        with self.added:
+            previous_slot = (self.last - 1) % self.capacity
+            previous = self.times[previous_slot] if self.size else 0.0
+            if level is None:
+                # Unprefixed lines (prints, tracebacks) belong with the line before them
+                level = self.levels[previous_slot] if self.size else LEVELS.index('INFO')
+            # The time index must not go backwards, even for lines stamped by racing threads
+            moment = max(moment, previous) if moment is not None else previous or time.time()
+            # Drop the oldest lines until both the line slots and the text ring have room
+            while self.size and (self.size == self.capacity or self.written + len(data)
+                                 - self.offsets[(self.first - 1) % self.capacity] > self.buffer_bytes):
+                self.size -= 1
+            self.last += 1
+            slot = (self.last - 1) % self.capacity
+            self.times[slot] = moment
+            self.levels[slot] = level
+            self.offsets[slot] = self.written
+            self._write_text(data)
+            self.size += 1
+            self.by_level[level].append(self.last)
+            for court in courts:
+                self.by_court.setdefault(court, array('q')).append(self.last)
+            if self.last % self.capacity == 0:
+                self._trim()
+            self.added.notify_all()
+        return self.last
+
+    def _write_text(self, data):
+        position = self.written % self.buffer_bytes
+        head = min(len(data), self.buffer_bytes - position)
+        self.text[position:position + head] = data[:head]
+        self.text[:len(data) - head] = data[head:]
+        self.written += len(data)
+
+    def _line(self, seq):
+        start = self.offsets[(seq - 1) % self.capacity]
+        end = self.offsets[seq % self.capacity] if seq < self.last else self.written
+        position = start % self.buffer_bytes
+        if position + end - start <= self.buffer_bytes:
+            data = self.text[position:position + end - start]
+        else:
+            data = self.text[position:] + self.text[:position + end - start - self.buffer_bytes]
+        return data.decode('utf-8', errors='replace')
+
+    def _trim(self):
+        # Drop index entries for lines that have left the ring
+        first = self.first
+        self.by_level = [postings[bisect_left(postings, first):] for postings in self.by_level]
+        for court in list(self.by_court):
+            postings = self.by_court[court][bisect_left(self.by_court[court], first):]
+            if postings:
+                self.by_court[court] = postings
+            else:
+                del self.by_court[court]
+
+    def _entry(self, seq):
+        return seq, self._line(seq)
+
+    def since(self, since, limit=None):
+        # Lines after sequence number `since`, the newest `limit` of them if given
+        with self.lock:
+            start = max(since + 1, self.first, self.last - limit + 1 if limit else 1)
+            return [self._entry(seq) for seq in range(start, self.last + 1)], self.last
+
+    def query(self, since=0, level=None, court=None, start=None, end=None, text=None, limit=1000):
+        # Newest `limit` matches; level is a minimum, start and end are unix times
+        with self.lock:
+            if not self.size:
+                return [], self.last
+            times = _TimeView(self)
+            low = max(since + 1, self.first)
+            high = self.last + 1
+            if start is not None:
+                low = max(low, self.first + bisect_left(times, start))
+            if end is not None:
+                high = min(high, self.first + bisect_left(times, end))
+            if low >= high:
+                return [], self.last
+
+            if court is not None:
+                postings = self.by_court.get(court, array('q'))
+                candidates = postings[bisect_left(postings, low):bisect_left(postings, high)]
+            elif level:
+                candidates = sorted(seq for postings in self.by_level[level:]
+                                    for seq in postings[bisect_left(postings, low):bisect_left(postings, high)])
+            else:
+                candidates = range(low, high)
+
+            matches = []
+            needle = text.lower() if text else None
+            for seq in reversed(candidates):
+                slot = (seq - 1) % self.capacity
+                if level and self.levels[slot] < level:
+                    continue
+                if needle and needle not in self._line(seq).lower():
+                    continue
+                matches.append(seq)
+                if limit and len(matches) >= limit:
+                    break
+            entries = []
+            for seq in reversed(matches):
+                slot = (seq - 1) % self.capacity
+                line = self._line(seq)
+                entries.append({
+                    'seq': seq,
+                    'time': datetime.fromtimestamp(self.times[slot]).isoformat(timespec='milliseconds'),
+                    'level': LEVELS[self.levels[slot]],
+                    'courts': sorted(set(COURT_PATTERN.findall(line))),
+                    'line': line,
+                })
+            return entries, self.last
@@ -0,0 +1,138 @@
+import atexit
+import logging
+import threading
+import time
+
+from config import METRICS_FILE
+from storage import read_json, write_json_atomic
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+FLUSH_INTERVAL = 2.0  # seconds; writes in between are batched
+
+HELP = {
+    'court_light_commands_total': 'Commands sent to a light',
+    'court_light_skipped_total': 'Transitions skipped because the light was already in the target state',
+    'court_light_retries_total': 'Extra command attempts after a failed confirmation',
+    'court_light_failures_total': 'Transitions that could not be confirmed',
+    'court_light_command_seconds': 'Time for a light to accept a command',
+    'court_light_confirm_seconds': 'Time from command until the new state was read back',
+    'reservation_fetch_total': 'Reservation API requests by HTTP status',
+    'reservation_fetch_bytes_total': 'Bytes received from the reservation API',
+    'reservation_fetch_seconds': 'Reservation API request duration',
+    'schedule_drift_seconds': 'Delay between a scheduled transition and the lights reaching it',
+    'scheduled_job_delay_seconds': 'Delay between a job\'s scheduled time and its start',
+}
+
+
+def _key(name, labels):
+    return name + ''.join(f'|{k}={v}' for k, v in sorted(labels.items()))
+
+
+class MetricsStore:
+    def __init__(self, path=METRICS_FILE):
+        self.path = path
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.data = (read_json(path) if path else None) or {'counters': {}, 'histograms': {}}
+        self.dirty = False
+        self.last_flush = 0.0
+        self.timer = None
+
+    def inc(self, name, labels=None, value=1):
+        if not self.enabled:
+            return
+        labels = labels or {}
+        with self.lock:
+            entry = self.data['counters'].setdefault(_key(name, labels), {'name': name, 'labels': labels, 'value': 0})
+            entry['value'] += value
+            self._changed()
+
+    def observe(self, name, value, labels=None):
+        if not self.enabled or value is None:
+            return
+        labels = labels or {}
+        with self.lock:
+            entry = self.data['histograms'].setdefault(_key(name, labels), {
+                'name': name, 'labels': labels, 'bounds': list(BUCKETS),
+                'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0,
+            })
+            for i, bound in enumerate(entry['bounds']):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+            self._changed()
+
+    def _changed(self):
+        self.dirty = True
+        wait = FLUSH_INTERVAL - (time.monotonic() - self.last_flush)
+        if wait <= 0:
+            self._write()
+        elif self.timer is None:
+            # The rest of a burst is written when the interval is up, not at the next change
+            self.timer = threading.Timer(wait, self._flush_pending)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_pending(self):
+        with self.lock:
+            self.timer = None
+            if self.dirty:
+                self._write()
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self._write()
+
+    def _write(self):
+        self.last_flush = time.monotonic()
+        if not self.path:
+            return
+        try:
+            write_json_atomic(self.path, self.data)
+            self.dirty = False
+        except OSError as e:
+            logging.warning(f"Could not write metrics: {e}")
+
+
+def _labels(labels, extra=None):
+    items = dict(labels)
+    if extra:
+        items.update(extra)
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in items.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(items, escaped)) + '}'
+
+
+def render_prometheus(data):
+    data = data or {'counters': {}, 'histograms': {}}
+    lines = []
+    by_name = {}
+    for entry in data['counters'].values():
+        by_name.setdefault((entry['name'], 'counter'), []).append(entry)
+    for entry in data['histograms'].values():
+        by_name.setdefault((entry['name'], 'histogram'), []).append(entry)
+
+    for (name, kind), entries in sorted(by_name.items()):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} {kind}")
+        for entry in entries:
+            if kind == 'counter':
+                lines.append(f"{name}{_labels(entry['labels'])} {entry['value']}")
+                continue
+            for bound, count in zip(entry['bounds'], entry['buckets']):
+                lines.append(f"{name}_bucket{_labels(entry['labels'], {'le': bound})} {count}")
+            lines.append(f"{name}_bucket{_labels(entry['labels'], {'le': '+Inf'})} {entry['count']}")
+            lines.append(f"{name}_sum{_labels(entry['labels'])} {entry['sum']}")
+            lines.append(f"{name}_count{_labels(entry['labels'])} {entry['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def load_metrics(path=METRICS_FILE):
+    return read_json(path)
+
+
+metrics = MetricsStore()
+atexit.register(metrics.flush)
@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
+
+import requests
+
+from config import API_DATE_PARAM, API_URL, PREFETCH_DAYS, PREFETCH_DIR, PREFETCH_INTERVAL
+from fetcher import ReservationFetcher, create_session
+
+
+def dated_url(url, day):
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != API_DATE_PARAM]
+    query.append((API_DATE_PARAM, day.strftime('%Y-%m-%d')))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class ReservationPrefetcher:
+    def __init__(self, url=API_URL, days=PREFETCH_DAYS, directory=PREFETCH_DIR,
+                 interval=PREFETCH_INTERVAL, on_update=None):
+        self.url = url
+        self.days = days
+        self.directory = directory
+        self.interval = interval
+        self.on_update = on_update
+        self.session = create_session(pool_size=max(1, days))
+        self.fetchers = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.refresh_event = threading.Event()
+        self.thread = None
+
+    def fetcher_for(self, day):
+        with self.lock:
+            fetcher = self.fetchers.get(day)
+            if fetcher is None:
+                cache_file = os.path.join(self.directory, f"{day.strftime('%Y-%m-%d')}.json")
+                fetcher = ReservationFetcher(url=dated_url(self.url, day), cache_file=cache_file,
+                                             session=self.session)
+                self.fetchers[day] = fetcher
+            return fetcher
+
+    def reservations_for(self, day):
+        # Served from the dated cache only; never touches the network
+        fetcher = self.fetcher_for(day)
+        if fetcher.cache:
+            return fetcher.cache['payload'].get('reservations')
+        return None
+
+    def _refresh_day(self, day):
+        fetcher = self.fetcher_for(day)
+        previous = fetcher.cache['payload'].get('reservations') if fetcher.cache else None
+        try:
+            reservations = fetcher.fetch()
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logging.warning(f"Prefetch for {day} failed, keeping cached copy: {e}")
+            return False
+        if self.on_update is not None and reservations != previous:
+            self.on_update(day, reservations)
+        return True
+
+    def refresh(self):
+        today = datetime.now().date()
+        days = [today + timedelta(days=offset) for offset in range(self.days)]
+        with ThreadPoolExecutor(max_workers=len(days), thread_name_prefix="prefetch") as pool:
+            results = list(pool.map(self._refresh_day, days))
+        self._prune(today)
+        logging.info(f"Prefetched reservations for {sum(results)}/{len(days)} days")
+        return dict(zip(days, results))
+
+    def _prune(self, today):
+        keep_from = (today - timedelta(days=1)).strftime('%Y-%m-%d')
+        with self.lock:
+            for day in [day for day in self.fetchers if day.strftime('%Y-%m-%d') < keep_from]:
+                del self.fetchers[day]
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name.endswith('.json') and name[:-5] < keep_from:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def refresh_soon(self):
+        self.refresh_event.set()
+
+    def start(self):
+        if self.days > 0 and self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Reservation prefetch failed: {e}")
+            self.refresh_event.wait(self.interval)
+            self.refresh_event.clear()
+
+    def stop(self):
+        self.stop_event.set()
+        self.refresh_event.set()
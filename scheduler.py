@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from clock import system_clock
+from metrics import metrics
+
+SKIP = 'skip'    # a run that comes due while the previous one is still going is dropped
+QUEUE = 'queue'  # such a run starts as soon as the previous one finishes (at most one waits)
+MISFIRE_GRACE = 300  # seconds; runs found later than this (suspend, clock jump) wait for the next time
+
+
+class Job:
+    def __init__(self, name, func, times, overrun=SKIP):
+        self.name = name
+        self.func = func
+        self.times = times
+        self.overrun = overrun
+        self.lock = threading.Lock()
+        self.thread = None
+        self.queued = None
+
+    def next_run(self, after):
+        candidates = [datetime.combine(after.date() + timedelta(days=days), at)
+                      for days in (0, 1) for at in self.times]
+        return min(moment for moment in candidates if moment > after)
+
+
+class Scheduler:
+    # One timer thread sleeps until the earliest job; each run gets its own thread so long jobs never block it
+    def __init__(self, stop_event, clock=system_clock, grace=MISFIRE_GRACE):
+        self.stop_event = stop_event
+        self.clock = clock
+        self.grace = grace
+        self.jobs = {}
+        self.queue = []
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def daily(self, name, times, func, overrun=SKIP):
+        job = Job(name, func, sorted(datetime.strptime(at, '%H:%M').time() for at in times), overrun)
+        with self.lock:
+            self.jobs[name] = job
+            self._push(job.next_run(self.clock.now()), job, None)
+        self.wake()
+        return job
+
+    def run_now(self, name, *args):
+        # A one-off run outside the timetable, subject to the same overrun policy
+        with self.lock:
+            self._push(self.clock.now(), self.jobs[name], args)
+        self.wake()
+
+    def wake(self):
+        self.wakeup.set()
+
+    def _push(self, due, job, args):
+        heapq.heappush(self.queue, (due, next(self.counter), job, args))
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.lock:
+                moment = self.clock.now()
+                due = []
+                while self.queue and self.queue[0][0] <= moment:
+                    at, _, job, args = heapq.heappop(self.queue)
+                    if args is None:
+                        self._push(job.next_run(moment), job, None)
+                    due.append((at, job, args))
+                next_due = self.queue[0][0] if self.queue else None
+                self.wakeup.clear()
+
+            for at, job, args in due:
+                self._fire(job, at, moment, args or ())
+
+            timeout = None if next_due is None else (next_due - self.clock.now()).total_seconds()
+            if self.clock.max_wait is not None:
+                # Re-read the wall clock now and then in case it was set (e.g. by NTP after boot)
+                timeout = self.clock.max_wait if timeout is None else min(timeout, self.clock.max_wait)
+            if timeout is None or timeout > 0:
+                self.clock.wait(self.wakeup, timeout)
+
+    def _fire(self, job, at, moment, args):
+        lateness = (moment - at).total_seconds()
+        if lateness > self.grace:
+            logging.warning(f"Skipping {job.name} due at {at.strftime('%H:%M')}, {lateness:.0f}s late")
+            return
+        with job.lock:
+            if job.thread is not None:
+                if job.overrun == QUEUE:
+                    logging.info(f"{job.name} is still running; it will run again when it finishes")
+                    job.queued = args
+                else:
+                    logging.info(f"{job.name} is still running; skipping the run due at {at.strftime('%H:%M')}")
+                return
+            job.thread = threading.Thread(target=self._execute, args=(job, args), name=job.name)
+            job.thread.start()
+        metrics.observe('scheduled_job_delay_seconds', lateness, {'job': job.name})
+
+    def _execute(self, job, args):
+        while True:
+            try:
+                job.func(*args)
+            except Exception as e:
+                logging.error(f"Scheduled job {job.name} failed: {e}")
+            with job.lock:
+                if job.queued is None or self.stop_event.is_set():
+                    job.thread = None
+                    job.queued = None
+                    return
+                args, job.queued = job.queued, None
+
+    def join(self, timeout=None):
+        for job in list(self.jobs.values()):
+            thread = job.thread
+            if thread is not None:
+                thread.join(timeout)
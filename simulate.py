@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+from clock import VirtualClock
+from config import IS_PRODUCTION, setup_devices
+from events import EventStore
+from journal import StateJournal
+from metrics import metrics
+from state_cache import StateCache
+from timeline import ALL_OFF, compile_day, device_targets
+
+import app
+
+DAY_START = datetime.min.time().replace(hour=4, minute=10)  # when daily_routine runs
+
+SAMPLE_RESERVATIONS = {
+    "05:30": ["Half Court A"], "06:30": ["Half Court B"], "07:30": ["Half Court B", "Half Court A"],
+    "08:30": ["Full Court"], "09:30": ["Full Court"], "10:30": ["Full Court"], "11:30": ["Full Court"],
+    "12:30": ["Full Court"], "13:30": ["Full Court"], "14:30": ["Full Court"], "15:30": ["Full Court"],
+    "16:30": ["Full Court"], "17:30": ["Full Court"], "18:30": ["Half Court A", "Half Court B"],
+    "19:30": ["Half Court A", "Half Court B"], "20:30": ["Half Court B"], "21:30": ["Full Court"]
+}
+
+# name: (day, reservations, expected commands, expected minutes on for Full Court, Half Court A, Half Court B)
+SCENARIOS = {
+    'weekday': (date(2024, 9, 2), SAMPLE_RESERVATIONS, 16, (450, 320, 380)),
+    'weekend': (date(2024, 9, 1), SAMPLE_RESERVATIONS, 16, (495, 365, 425)),
+    'evening only': (date(2024, 9, 3), {"19:30": ["Half Court A"], "20:30": ["Half Court B"]}, 16, (210, 140, 140)),
+    'morning only': (date(2024, 9, 4), {"05:30": ["Full Court"], "06:30": ["Full Court"]}, 6, (135, 135, 135)),
+    'daytime only': (date(2024, 9, 5), {"10:30": ["Full Court"], "11:30": ["Half Court A"]}, 0, (0, 0, 0)),
+    'past midnight': (date(2024, 9, 6), {"21:30": ["Full Court"], "22:30": ["Half Court A"],
+                                         "23:30": ["Half Court B"]}, 16, (270, 200, 200)),
+    'alternating courts': (date(2024, 9, 7), {"18:30": ["Half Court A"], "19:30": ["Half Court B"],
+                                              "20:30": ["Half Court A"], "21:30": ["Half Court B"]},
+                           20, (375, 245, 245)),
+}
+LIGHTS = ('Full Court', 'Half Court A', 'Half Court B')
+
+
+class RecordingDevice:
+    def __init__(self, device, clock):
+        self.device = device
+        self.clock = clock
+        self.name = device.name
+        self.commands = 0
+        self.changes = []
+
+    @property
+    def state(self):
+        return self.device.state
+
+    def _switch(self, turn_on):
+        self.commands += 1
+        if turn_on != self.device.state:
+            self.changes.append((self.clock.now(), turn_on))
+        if turn_on:
+            self.device.turn_on()
+        else:
+            self.device.turn_off()
+
+    def turn_on(self):
+        self._switch(True)
+
+    def turn_off(self):
+        self._switch(False)
+
+
+def ideal_changes(plan):
+    changes = {}
+    current = dict(device_targets(ALL_OFF))
+    for transition in plan:
+        for light, on in device_targets(transition.state):
+            if current[light] != on:
+                changes.setdefault(light, []).append((transition.at, on))
+                current[light] = on
+    return changes
+
+
+def on_minutes(changes, start, end):
+    total, lit_since = 0.0, None
+    for moment, on in changes:
+        if on and lit_since is None:
+            lit_since = moment
+        elif not on and lit_since is not None:
+            total += (moment - lit_since).total_seconds()
+            lit_since = None
+    if lit_since is not None:
+        total += (end - lit_since).total_seconds()
+    return total / 60
+
+
+def switching_latencies(ideal, actual):
+    latencies, missed = [], 0
+    for moment, on in ideal:
+        reached = next((at for at, state in actual if state == on and at >= moment), None)
+        if reached is None:
+            missed += 1
+        else:
+            latencies.append((reached - moment).total_seconds())
+    return latencies, missed
+
+
+def simulate_day(reservations, day):
+    clock = VirtualClock(datetime.combine(day, DAY_START))
+    devices = {light: RecordingDevice(device, clock) for light, device in setup_devices().items()}
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.control_lights(devices, reservations, clock=clock, state_cache=StateCache(path=None, clock=clock),
+                           journal=StateJournal(path=None, clock=clock), events=EventStore(path=None))
+    end = clock.now()
+
+    ideal = ideal_changes(compile_day(reservations, day))
+    report = {'commands': 0, 'latencies': [], 'missed': 0, 'on_minutes': {}}
+    for light, device in devices.items():
+        latencies, missed = switching_latencies(ideal.get(light, []), device.changes)
+        report['commands'] += device.commands
+        report['latencies'] += latencies
+        report['missed'] += missed
+        report['on_minutes'][light] = on_minutes(device.changes, clock.start, end)
+    return report
+
+
+def merge_reports(reports):
+    total = {'days': len(reports), 'commands': 0, 'latencies': [], 'missed': 0, 'on_minutes': {}}
+    for report in reports:
+        total['commands'] += report['commands']
+        total['latencies'] += report['latencies']
+        total['missed'] += report['missed']
+        for light, minutes in report['on_minutes'].items():
+            total['on_minutes'][light] = total['on_minutes'].get(light, 0.0) + minutes
+    return total
+
+
+def check_report(report, commands=None, minutes=None):
+    # Problems with a simulated run: missed switches always, and differences from the expected values if given
+    problems = []
+    if report['missed']:
+        problems.append(f"{report['missed']} planned switches never happened")
+    if commands is not None and report['commands'] != commands:
+        problems.append(f"{report['commands']} commands sent, expected {commands}")
+    for light, expected in zip(LIGHTS, minutes or ()):
+        actual = round(report['on_minutes'].get(light, 0.0))
+        if actual != expected:
+            problems.append(f"{light} on for {actual} min, expected {expected}")
+    return problems
+
+
+def print_report(title, report, elapsed):
+    latencies = report['latencies']
+    mean = sum(latencies) / len(latencies) if latencies else 0.0
+    print(f"{title}: {report['commands']} commands, {len(latencies)} switches, {report['missed']} missed, "
+          f"latency mean {mean:.2f}s max {max(latencies, default=0.0):.2f}s, simulated in {elapsed * 1000:.0f} ms")
+    for light, minutes in sorted(report['on_minutes'].items()):
+        print(f"    {light}: {minutes:.0f} min on")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run control_lights against the mock devices on a virtual clock")
+    parser.add_argument('--payload', help="JSON file with an API payload or a reservations map")
+    parser.add_argument('--date', help="first simulated day (YYYY-MM-DD)")
+    parser.add_argument('--days', type=int, default=1, help="number of consecutive days to simulate, e.g. 365")
+    args = parser.parse_args()
+
+    if IS_PRODUCTION:
+        sys.exit("The simulation drives the mock devices. Run it with IS_PRODUCTION=false.")
+    logging.getLogger().setLevel(logging.WARNING)
+    metrics.enabled = False  # virtual-time runs must not end up in the production metrics
+
+    if args.payload:
+        with open(args.payload) as f:
+            payload = json.load(f)
+        scenarios = {args.payload: (date.today(), app.clean_court_names(payload.get('reservations', payload)),
+                                    None, None)}
+    else:
+        scenarios = SCENARIOS
+    if args.date or args.days > 1:
+        # The expected values only hold for the scenario's own day
+        first_day = datetime.strptime(args.date, "%Y-%m-%d").date() if args.date else None
+        scenarios = {name: (first_day or day, reservations, None, None)
+                     for name, (day, reservations, _, _) in scenarios.items()}
+
+    failed = 0
+    for name, (first_day, reservations, commands, minutes) in scenarios.items():
+        started = time.perf_counter()
+        reports = [simulate_day(reservations, first_day + timedelta(days=offset)) for offset in range(args.days)]
+        elapsed = time.perf_counter() - started
+        title = name if args.days == 1 else f"{name} x {args.days} days"
+        report = merge_reports(reports)
+        print_report(title, report, elapsed)
+        for problem in check_report(report, commands, minutes):
+            print(f"    FAILED: {problem}")
+            failed += 1
+    if failed:
+        sys.exit(f"{failed} check(s) failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import logging
+import threading
+from datetime import datetime
+
+from clock import system_clock
+from config import DEVICE_STATE_FILE, STATE_FRESHNESS, check_device_status
+from storage import read_json, write_json_atomic
+
+
+def load_states(path=DEVICE_STATE_FILE):
+    return read_json(path) or {}
+
+
+class StateCache:
+    def __init__(self, path=DEVICE_STATE_FILE, freshness=STATE_FRESHNESS, clock=system_clock):
+        self.path = path
+        self.clock = clock
+        self.freshness = freshness
+        self.lock = threading.Lock()
+        self.states = load_states(path) if path else {}
+
+    def get(self, light):
+        with self.lock:
+            entry = self.states.get(light)
+        if entry is None:
+            return None, None
+        return entry['state'], entry['confirmed_at']
+
+    def is_fresh(self, light):
+        state, confirmed_at = self.get(light)
+        return state is not None and self.clock.time() - confirmed_at <= self.freshness
+
+    def record(self, light, state):
+        now = self.clock.time()
+        with self.lock:
+            entry = self.states[light] = {'state': state, 'confirmed_at': now}
+            if self.path:
+                # Readable time for the file, which /device_states serves
+                entry['confirmed'] = datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S')
+            self._save()
+
+    def forget(self, light):
+        with self.lock:
+            if self.states.pop(light, None) is not None:
+                self._save()
+
+    def is_current(self, light, device, target):
+        # True when the light is known to be in the target state already
+        if self.is_fresh(light):
+            return self.get(light)[0] == target
+        try:
+            matches = check_device_status(device, target) is True
+        except Exception as e:
+            logging.warning(f"Could not refresh cached state of {light} light: {e}")
+            return False
+        if matches:
+            self.record(light, target)
+        return matches
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            write_json_atomic(self.path, self.states)
+        except OSError as e:
+            logging.warning(f"Could not write device state cache: {e}")
+
+
+state_cache = StateCache()
@@ -1,28 +1,95 @@
-import tinytuya
-from config import DEVICES
-
-# Function to check and print the status of a single device
-def check_device_status(name, device_info):
-    print(f"\nChecking status for {name}:")
-    
-    # Connect to the device
-    device = tinytuya.OutletDevice(
-        dev_id=device_info['id'],
-        address=device_info['ip'],
-        local_key=device_info['key'],
-        version=3.4
-    )
-    
-    # Fetch and print the device status
-    status = device.status()
-    if 'dps' in status and '1' in status['dps']:
-        if status['dps']['1']:
-            print(f'{name} is ON')
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from config import DEVICES, IS_PRODUCTION
+from device_pool import DevicePool, connect_tuya_device
+from discovery import DeviceDiscovery
+
+
+# Query a single device over its pooled session and time the round trip
+def check_device_status(name, device):
+    started = time.monotonic()
+    result = {'device': name, 'ip': None, 'state': None, 'rtt_ms': None, 'error': None}
+    try:
+        status = device.status()
+        if 'dps' in status and '1' in status['dps']:
+            result['state'] = bool(status['dps']['1'])
         else:
-            print(f'{name} is OFF')
+            result['error'] = 'no switch state in response'
+    except Exception as e:
+        result['error'] = str(e) or e.__class__.__name__
+    result['ip'] = device.address
+    result['rtt_ms'] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+def scan(pool, executor, pending, deadline):
+    # Every device is queried at once; slow ones are reported as timed out at the deadline
+    checked_at = datetime.now().isoformat(timespec='seconds')
+    for name, device in pool.devices.items():
+        if name not in pending or pending[name].done():
+            pending[name] = executor.submit(check_device_status, name, device)
+
+    finish_by = time.monotonic() + deadline
+    results = []
+    for name, future in pending.items():
+        try:
+            result = future.result(timeout=max(0, finish_by - time.monotonic()))
+        except FutureTimeout:
+            result = {'device': name, 'ip': pool.devices[name].address, 'state': None,
+                      'rtt_ms': None, 'error': f'no response within {deadline:g}s'}
+        result['checked_at'] = checked_at
+        results.append(result)
+    return results
+
+
+def print_results(results, output):
+    if output == 'json':
+        print(json.dumps(results))
+    elif output == 'ndjson':
+        for result in results:
+            print(json.dumps(result))
     else:
-        print(f'Failed to retrieve status for {name}')
+        for result in results:
+            if result['error']:
+                print(f"{result['device']}: failed to retrieve status ({result['error']})")
+            else:
+                print(f"{result['device']} is {'ON' if result['state'] else 'OFF'} ({result['rtt_ms']:.0f} ms)")
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the state of every court light")
+    parser.add_argument('--format', choices=('text', 'json', 'ndjson'), default='text', dest='output')
+    parser.add_argument('--timeout', type=float, default=1.0, help="per-device deadline in seconds")
+    parser.add_argument('--watch', action='store_true', help="keep polling over the same connections")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between scans in watch mode")
+    args = parser.parse_args()
+
+    if not IS_PRODUCTION:
+        sys.exit("status-check.py talks to the real devices. Set IS_PRODUCTION=true and the device settings in .env.")
+
+    pool = DevicePool(DEVICES, connect=lambda info: connect_tuya_device(info, timeout=args.timeout),
+                      discovery=DeviceDiscovery())
+    executor = ThreadPoolExecutor(max_workers=len(pool.devices), thread_name_prefix="status")
+    pending = {}
+    try:
+        while True:
+            started = time.monotonic()
+            print_results(scan(pool, executor, pending, args.timeout), args.output)
+            if not args.watch:
+                break
+            time.sleep(max(0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown(wait=False)
+        pool.close()
+
 
-# Iterate through all devices and check their status
-for name, info in DEVICES.items():
-    check_device_status(name, info)
+if __name__ == "__main__":
+    main()
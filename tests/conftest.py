@@ -0,0 +1,11 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# The modules read their settings at import: run against the mock devices and a throwaway data directory
+os.environ['IS_PRODUCTION'] = 'false'
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='court-tests-')
+atexit.register(shutil.rmtree, os.environ['DATA_DIR'], ignore_errors=True)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
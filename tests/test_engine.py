@@ -0,0 +1,72 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+from clock import VirtualClock
+from engine import Engine, MockLight, Site, load_rules
+
+MONDAY = date(2024, 9, 2)
+LIGHTS = frozenset({"North", "South"})
+COURT_LIGHTS = {"Full Court": LIGHTS}
+
+
+def make_site(clock, fetch):
+    devices = {light: MockLight(light) for light in LIGHTS}
+    site = Site("Main Hall", "http://127.0.0.1:9/reservations", load_rules({}, COURT_LIGHTS, LIGHTS), COURT_LIGHTS,
+                devices, 0, None, clock, state_cache=None)
+    site._fetch = fetch
+    return site
+
+
+def run(site, coroutine, workers=2):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        engine = Engine([site], executor)
+        return asyncio.run(coroutine(engine))
+
+
+def test_refresh_stops_after_midnight():
+    # The site API has no date; after midnight it would return the next day's bookings
+    clock = VirtualClock(datetime(2024, 9, 3, 0, 10))
+    fetched = []
+    site = make_site(clock, lambda day: fetched.append(day) or {})
+    run(site, lambda engine: site.keep_fresh(engine, MONDAY))
+    assert fetched == []
+
+
+def test_refresh_that_runs_past_midnight_is_dropped():
+    clock = VirtualClock(datetime(2024, 9, 2, 23, 59, 59))
+
+    def fetch(day):
+        clock.sleep(2)
+        return {"09:30": ["Full Court"]}
+
+    site = make_site(clock, fetch)
+    assert run(site, lambda engine: site.load(engine, MONDAY, refresh=True)) is True
+    assert site.reservations is None and site.plan == ()
+
+
+class SlowLight:
+    # Reports itself on only after a few state reads, or never
+    def __init__(self, name, reads_needed):
+        self.name = name
+        self.reads_needed = reads_needed
+        self.reads = 0
+        self.sent = False
+
+    def turn_on(self):
+        self.sent = True
+
+    @property
+    def state(self):
+        self.reads += 1
+        return self.sent and self.reads_needed is not None and self.reads >= self.reads_needed
+
+
+def test_async_actuation_awaits_confirmation_on_one_io_thread():
+    clock = VirtualClock(datetime(2024, 9, 2, 18, 30))
+    devices = {"North": SlowLight("North", 3), "South": SlowLight("South", None)}
+    site = make_site(clock, lambda day: {})
+    site.devices = devices
+    assert run(site, lambda engine: site.apply(engine, LIGHTS), workers=1) is False
+    assert devices["North"].reads == 3
+    assert devices["South"].reads > 3
@@ -0,0 +1,33 @@
+from logstore import LEVELS, LogStore
+
+
+def line(n, level='INFO', court='Half Court A'):
+    return f"2024-09-02 18:{n // 60 % 60:02d}:{n % 60:02d},000 - {level} - {court} light turned on #{n}"
+
+
+def test_text_ring_wraps_and_drops_the_oldest_lines():
+    store = LogStore(capacity=100, path=None, buffer_bytes=500)
+    for n in range(40):
+        store.append(line(n))
+    texts = [text for _, text in store.since(0)[0]]
+    assert texts == [line(n) for n in range(40 - len(texts), 40)]
+    # As many lines as fit, and no more
+    assert sum(map(len, texts)) <= 500 < sum(map(len, texts)) + len(line(39))
+
+
+def test_line_slots_bound_the_ring_too():
+    store = LogStore(capacity=5, path=None, buffer_bytes=1 << 16)
+    for n in range(12):
+        store.append(line(n))
+    assert [seq for seq, _ in store.since(0)[0]] == [8, 9, 10, 11, 12]
+
+
+def test_query_filters_by_level_court_and_text_after_wrapping(tmp_path):
+    store = LogStore(capacity=50, path=str(tmp_path / 'logs.ring'), buffer_bytes=2000)
+    for n in range(200):
+        store.append(line(n, 'ERROR' if n % 10 == 0 else 'INFO', 'Half Court B' if n % 4 == 0 else 'Full Court'))
+    errors, _ = store.query(level=LEVELS.index('ERROR'), court='Half Court B', limit=None)
+    # Sequence numbers start at 1, so line n is seq n + 1
+    assert [entry['line'] for entry in errors] == [line(n, 'ERROR', 'Half Court B')
+                                                   for n in range(store.first - 1, 200) if n % 20 == 0]
+    assert store.query(text='#199', limit=None)[0][0]['line'] == line(199, 'INFO', 'Full Court')
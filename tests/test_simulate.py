@@ -0,0 +1,25 @@
+import pytest
+
+import simulate
+from metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def no_metrics():
+    metrics.enabled = False
+    yield
+    metrics.enabled = True
+
+
+@pytest.mark.parametrize('name', list(simulate.SCENARIOS))
+def test_scenario_matches_expected_day(name):
+    day, reservations, commands, minutes = simulate.SCENARIOS[name]
+    report = simulate.simulate_day(reservations, day)
+    assert simulate.check_report(report, commands, minutes) == []
+
+
+def test_check_report_flags_missed_switches_and_regressions():
+    report = {'commands': 17, 'missed': 1, 'on_minutes': {'Full Court': 450.0, 'Half Court A': 300.0}}
+    problems = simulate.check_report(report, 16, (450, 320, 0))
+    assert problems == ["1 planned switches never happened", "17 commands sent, expected 16",
+                        "Half Court A on for 300 min, expected 320"]
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from datetime import date, datetime
+
+from clock import VirtualClock
+from timeline import (ALL_OFF, ALL_ON, FULL_ONLY, CourtState, PlanRunner, compile_day, explain_day,
+                      merge_reservations, state_for_courts)
+
+MONDAY = date(2024, 9, 2)
+SATURDAY = date(2024, 9, 7)
+HALF_A = CourtState(True, False, False)
+HALF_B = CourtState(False, True, False)
+
+
+def at(day, clock_time):
+    return datetime.combine(day, datetime.strptime(clock_time, "%H:%M").time())
+
+
+def plan(reservations, day):
+    return [(transition.at.strftime("%H:%M"), transition.state, transition.reason)
+            for transition in compile_day(reservations, day)]
+
+
+def test_merge_reservations_joins_back_to_back_slots_with_the_same_lights():
+    reservations = {"10:30": ["Half Court A"], "08:30": ["Full Court"], "09:30": ["Full Court"],
+                    "12:30": ["Half Court A"]}
+    assert merge_reservations(reservations, MONDAY) == [
+        (at(MONDAY, "08:30"), at(MONDAY, "10:30"), ALL_ON, ("Full Court",)),
+        (at(MONDAY, "10:30"), at(MONDAY, "11:30"), HALF_A, ("Half Court A",)),
+        (at(MONDAY, "12:30"), at(MONDAY, "13:30"), HALF_A, ("Half Court A",)),
+    ]
+
+
+def test_full_court_booking_lights_both_halves():
+    assert state_for_courts(["Full Court"]) == ALL_ON
+    assert state_for_courts(["Half Court B"]) == HALF_B
+
+
+def test_weekday_lights_come_on_early_before_the_first_reservation():
+    assert plan({"05:30": ["Half Court A"]}, MONDAY) == [
+        ("05:15", ALL_ON, "early activation before first reservation"),
+        ("05:30", HALF_A, "reservation 05:30-06:30 for Half Court A"),
+        ("06:30", ALL_ON, "closing: all lights on"),
+        ("06:35", FULL_ONLY, "closing: full court only"),
+        ("06:45", ALL_OFF, "all lights off"),
+    ]
+
+
+def test_weekend_uses_the_morning_period_instead_of_early_activation():
+    assert plan({"05:30": ["Half Court A"]}, SATURDAY)[:2] == [
+        ("04:30", ALL_ON, "weekend morning period"),
+        ("05:30", HALF_A, "reservation 05:30-06:30 for Half Court A"),
+    ]
+
+
+def test_off_period_overrides_reservations():
+    assert plan({"10:30": ["Full Court"]}, MONDAY) == [("07:30", ALL_OFF, "off period")]
+    # A booking running into the off period is cut short, without a closing tail
+    assert plan({"07:00": ["Half Court A"]}, MONDAY) == [
+        ("06:45", ALL_ON, "early activation before first reservation"),
+        ("07:00", HALF_A, "reservation 07:00-08:00 for Half Court A"),
+        ("07:30", ALL_OFF, "off period"),
+    ]
+
+
+def test_all_on_period_only_when_a_reservation_runs_past_its_start():
+    assert plan({"16:30": ["Half Court A"]}, MONDAY) == [("07:30", ALL_OFF, "off period")]
+    assert plan({"19:30": ["Half Court A"]}, MONDAY) == [
+        ("07:30", ALL_OFF, "off period"),
+        ("17:30", ALL_ON, "all-on period"),
+        ("18:30", ALL_OFF, "all lights off"),
+        ("19:15", ALL_ON, "early activation before first reservation"),
+        ("19:30", HALF_A, "reservation 19:30-20:30 for Half Court A"),
+        ("20:30", ALL_ON, "closing: all lights on"),
+        ("20:35", FULL_ONLY, "closing: full court only"),
+        ("20:45", ALL_OFF, "all lights off"),
+    ]
+
+
+def test_all_on_period_takes_precedence_over_a_reservation():
+    assert plan({"17:30": ["Half Court B"]}, MONDAY)[1] == ("17:30", ALL_ON, "all-on period")
+    explained = [(t.at.strftime("%H:%M"), t.reason) for t in explain_day({"17:30": ["Half Court B"]}, MONDAY)]
+    assert ("18:30", "closing: all lights on") in explained
+
+
+def test_closing_tail_follows_only_the_last_lit_period():
+    transitions = plan({"18:30": ["Half Court A"], "20:30": ["Half Court B"]}, MONDAY)
+    assert ("19:30", ALL_OFF, "all lights off") in transitions
+    assert [t for t in transitions if t[2].startswith("closing")] == [
+        ("21:30", ALL_ON, "closing: all lights on"),
+        ("21:35", FULL_ONLY, "closing: full court only"),
+    ]
+    assert transitions[-1] == ("21:45", ALL_OFF, "all lights off")
+
+
+def test_empty_payload():
+    assert compile_day({}, MONDAY) == ()
+    # The weekend morning period does not depend on bookings; its closing starts with all lights already on
+    assert plan({}, SATURDAY) == [
+        ("04:30", ALL_ON, "weekend morning period"),
+        ("05:35", FULL_ONLY, "closing: full court only"),
+        ("05:45", ALL_OFF, "all lights off"),
+    ]
+
+
+def test_async_runner_applies_the_transition_in_force_and_finishes():
+    applied = []
+
+    async def apply_state(state):
+        applied.append(state)
+        return True
+
+    day_plan = compile_day({"19:30": ["Half Court A"]}, MONDAY)
+    runner = PlanRunner(day_plan, MONDAY, apply_state, threading.Event(), VirtualClock(at(MONDAY, "20:50")),
+                        on_applied=lambda transition: applied.append(transition.reason))
+    assert asyncio.run(runner.run_async()) is True
+    assert applied == [ALL_OFF, "all lights off"]
@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+from clock import system_clock
+from metrics import metrics
+from tracing import tracer
+
+CourtState = namedtuple('CourtState', ['half_a', 'half_b', 'full'])
+Transition = namedtuple('Transition', ['at', 'state', 'reason'])
+
+ALL_ON = CourtState(True, True, True)
+ALL_OFF = CourtState(False, False, False)
+FULL_ONLY = CourtState(False, False, True)
+
+SLOT_LENGTH = timedelta(minutes=60)
+EARLY_ACTIVATION = timedelta(minutes=15)
+WEEKEND_MORNING = (time(4, 30), time(5, 30))
+OFF_PERIOD = (time(7, 30), time(17, 30))
+ALL_ON_PERIOD = (time(17, 30), time(18, 30))
+CLOSING_ALL_ON = timedelta(minutes=5)
+CLOSING_FULL_ONLY = timedelta(minutes=10)
+
+# Rule precedence when windows overlap: higher wins
+CLOSING, RESERVATION, MORNING, FIXED = range(4)
+
+
+def clean_court_names(reservations):
+    return {
+        reservation_time: [court.rstrip('.') for court in courts]
+        for reservation_time, courts in reservations.items()
+    }
+
+
+def state_for_courts(courts):
+    half_a_on = 'Half Court A' in courts or 'Full Court' in courts
+    half_b_on = 'Half Court B' in courts or 'Full Court' in courts
+    full_on = 'Full Court' in courts
+    return CourtState(half_a_on, half_b_on, full_on)
+
+
+def device_targets(state):
+    # The full-court light also comes on whenever either half is in use
+    return [
+        ('Full Court', state.full or state.half_a or state.half_b),
+        ('Half Court A', state.half_a),
+        ('Half Court B', state.half_b),
+    ]
+
+
+def describe_state(state):
+    lit = [name for name, on in zip(('Half Court A', 'Half Court B', 'Full Court'), state) if on]
+    return ', '.join(lit) if lit else 'all off'
+
+
+class SiteRules:
+    # Rule windows and light states for one site; the defaults describe the original three-light court.
+    # A window set to None is not applied.
+    def __init__(self, slot_length=SLOT_LENGTH, early_activation=EARLY_ACTIVATION,
+                 weekend_morning=WEEKEND_MORNING, off_period=OFF_PERIOD, all_on_period=ALL_ON_PERIOD,
+                 closing_all_on=CLOSING_ALL_ON, closing_full_only=CLOSING_FULL_ONLY,
+                 state_for_courts=state_for_courts, all_on=ALL_ON, all_off=ALL_OFF, closing_state=FULL_ONLY):
+        self.slot_length = slot_length
+        self.early_activation = early_activation
+        self.weekend_morning = weekend_morning
+        self.off_period = off_period
+        self.all_on_period = all_on_period
+        self.closing_all_on = closing_all_on
+        self.closing_full_only = closing_full_only
+        self.state_for_courts = state_for_courts
+        self.all_on = all_on
+        self.all_off = all_off
+        self.closing_state = closing_state
+
+
+DEFAULT_RULES = SiteRules()
+
+
+def _at(day, clock_time):
+    return datetime.combine(day, clock_time)
+
+
+@lru_cache(maxsize=None)  # at most 1440 distinct slot times
+def slot_time(reservation_time):
+    return datetime.strptime(reservation_time, "%H:%M").time()
+
+
+def reservation_slots(reservations, day, slot_length=SLOT_LENGTH):
+    slots = []
+    for reservation_time, courts in reservations.items():
+        start = datetime.combine(day, slot_time(reservation_time))
+        slots.append((start, start + slot_length, tuple(courts)))
+    slots.sort()
+    return slots
+
+
+def merge_reservations(reservations, day, rules=DEFAULT_RULES):
+    # Collapse back-to-back slots that light the same courts into one interval
+    merged = []
+    for start, end, courts in reservation_slots(reservations, day, rules.slot_length):
+        state = rules.state_for_courts(courts)
+        if merged and merged[-1][1] == start and merged[-1][2] == state:
+            previous_start, _, _, previous_courts = merged[-1]
+            merged[-1] = (previous_start, end, state, previous_courts)
+        else:
+            merged.append((start, end, state, courts))
+    return merged
+
+
+def _rule_segments(reservations, day, rules):
+    segments = []
+    slots = merge_reservations(reservations, day, rules)
+
+    for start, end, state, courts in slots:
+        segments.append((start, end, RESERVATION, state,
+                         f"reservation {start.strftime('%H:%M')}-{end.strftime('%H:%M')} for {', '.join(courts)}"))
+
+    if day.weekday() >= 5:
+        if rules.weekend_morning:
+            segments.append((_at(day, rules.weekend_morning[0]), _at(day, rules.weekend_morning[1]), MORNING,
+                             rules.all_on, "weekend morning period"))
+    elif slots and rules.early_activation:
+        earliest = slots[0][0]
+        segments.append((earliest - rules.early_activation, earliest, MORNING, rules.all_on,
+                         "early activation before first reservation"))
+
+    if slots:
+        if rules.off_period:
+            segments.append((_at(day, rules.off_period[0]), _at(day, rules.off_period[1]), FIXED, rules.all_off,
+                             "off period"))
+        if rules.all_on_period:
+            all_on_start = _at(day, rules.all_on_period[0])
+            if any(end > all_on_start for _, end, _, _ in slots):
+                segments.append((all_on_start, _at(day, rules.all_on_period[1]), FIXED, rules.all_on,
+                                 "all-on period"))
+    return segments
+
+
+def _evaluate(segments, all_off=ALL_OFF, by_reason=False):
+    boundaries = sorted({point for start, end, *_ in segments for point in (start, end)})
+    transitions = []
+    for point in boundaries:
+        active = [segment for segment in segments if segment[0] <= point < segment[1]]
+        if active:
+            _, _, _, state, reason = max(active, key=lambda segment: segment[2])
+        else:
+            state, reason = all_off, "all lights off"
+        # Only boundaries where the desired state changes need a command
+        if not transitions or transitions[-1].state != state or (by_reason and transitions[-1].reason != reason):
+            transitions.append(Transition(point, state, reason))
+    return transitions
+
+
+def _day_segments(reservations, day, rules):
+    segments = _rule_segments(reservations, day, rules)
+    transitions = _evaluate(segments, rules.all_off)
+
+    # Keep some lights on after the last lit period so players can leave
+    lit_until = None
+    for current, following in zip(transitions, transitions[1:]):
+        if current.state != rules.all_off:
+            lit_until = following.at
+    if lit_until is not None:
+        all_on_until = lit_until + rules.closing_all_on
+        segments.append((lit_until, all_on_until, CLOSING, rules.all_on, "closing: all lights on"))
+        segments.append((all_on_until, all_on_until + rules.closing_full_only, CLOSING, rules.closing_state,
+                         "closing: full court only"))
+    return segments
+
+
+def compile_day(reservations, day, rules=DEFAULT_RULES):
+    return tuple(_evaluate(_day_segments(reservations, day, rules), rules.all_off))
+
+
+def explain_day(reservations, day, rules=DEFAULT_RULES):
+    # Like compile_day, but also breaks where only the rule changes (e.g. all-on period into a reservation)
+    return tuple(_evaluate(_day_segments(reservations, day, rules), rules.all_off, by_reason=True))
+
+
+class IntervalIndex:
+    # Answers "what should be lit at T" over a compiled plan with binary search
+    def __init__(self, plan, all_off=ALL_OFF):
+        self.plan = tuple(plan)
+        self.all_off = all_off
+        self.times = [transition.at for transition in self.plan]
+
+    def transition_at(self, moment):
+        position = bisect_right(self.times, moment)
+        return self.plan[position - 1] if position else None
+
+    def state_at(self, moment):
+        transition = self.transition_at(moment)
+        return transition.state if transition else self.all_off
+
+    def next_after(self, moment):
+        position = bisect_right(self.times, moment)
+        return self.plan[position] if position < len(self.plan) else None
+
+    def between(self, start, end):
+        # (from, until, state, reason) intervals overlapping [start, end)
+        intervals = []
+        position = max(0, bisect_right(self.times, start) - 1)
+        while position < len(self.plan) and self.plan[position].at < end:
+            transition = self.plan[position]
+            until = self.times[position + 1] if position + 1 < len(self.plan) else None
+            if until is None or until > start:
+                intervals.append((max(transition.at, start), min(until, end) if until else end,
+                                  transition.state, transition.reason))
+            position += 1
+        if not intervals or intervals[0][0] > start:
+            first_at = intervals[0][0] if intervals else end
+            intervals.insert(0, (start, first_at, self.all_off, "before first transition"))
+        return intervals
+
+
+def diff_reservations(old, new):
+    old, new = old or {}, new or {}
+    return {
+        'added': sorted(t for t in new if t not in old),
+        'removed': sorted(t for t in old if t not in new),
+        'changed': sorted(t for t in new if t in old and new[t] != old[t]),
+    }
+
+
+class PlanRunner:
+    # apply_state returns whether every light confirmed; with run_async it is a coroutine function instead.
+    # site and describe are for the engine, whose states are sets of lit lights.
+    def __init__(self, plan, day, apply_state, stop_event, clock=system_clock, resume_from=None, on_applied=None,
+                 site='', describe=describe_state):
+        self.plan = plan
+        self.index = IntervalIndex(plan)
+        self.day = day
+        self.apply_state = apply_state
+        self.stop_event = stop_event
+        self.clock = clock
+        self.on_applied = on_applied
+        self.site = site
+        self.describe = describe
+        self.applied = resume_from  # a transition already in force, e.g. restored after a restart
+        self.announced = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.loop = None
+        self.async_wakeup = None
+
+    def log(self, message):
+        logging.info(f"[{self.site}] {message}" if self.site else message)
+
+    def wake(self):
+        self.wakeup.set()
+        loop, event = self.loop, self.async_wakeup
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(event.set)
+
+    def replace(self, plan):
+        # Swap in a recompiled plan; the run loop only acts if the desired state differs
+        with self.lock:
+            moment = self.clock.now()
+            old_future = {(t.at, t.state) for t in self.plan if t.at > moment}
+            new_future = {(t.at, t.state) for t in plan if t.at > moment}
+            self.plan = plan
+            self.index = IntervalIndex(plan)
+        self.wake()
+        return len(old_future ^ new_future)
+
+    def run(self):
+        self.running = True
+        try:
+            return self._run()
+        finally:
+            self.running = False
+
+    def _next(self):
+        # (transition to apply now, or None; the upcoming transition; seconds to wait for it)
+        with self.lock:
+            moment = self.clock.now()
+            current = self.index.transition_at(moment)
+            upcoming = self.index.next_after(moment)
+            self.wakeup.clear()
+            if self.async_wakeup is not None:
+                self.async_wakeup.clear()
+
+        if current is not None and current.state != (self.applied.state if self.applied else None):
+            lateness = (moment - current.at).total_seconds()
+            reason = current.reason[:1].upper() + current.reason[1:]  # court names keep their case
+            self.log(f"{reason} ({self.describe(current.state)}), {lateness:.2f}s after schedule")
+            return current, upcoming, 0.0
+        if upcoming is None:
+            return None, None, 0.0
+        if upcoming is not self.announced:
+            self.log(f"Next transition at {upcoming.at.strftime('%H:%M')}: {upcoming.reason}")
+            self.announced = upcoming
+        remaining = (upcoming.at - self.clock.now()).total_seconds()
+        if self.clock.max_wait is not None:
+            remaining = min(remaining, self.clock.max_wait)
+        return None, upcoming, remaining
+
+    def _applied(self, transition, confirmed):
+        if confirmed and self.on_applied is not None:
+            self.on_applied(transition)
+        if transition is self.announced:
+            # Only transitions we waited for count; resuming mid-slot is not drift
+            metrics.observe('schedule_drift_seconds', (self.clock.now() - transition.at).total_seconds(),
+                            {'site': self.site} if self.site else None)
+        self.applied = transition
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            current, upcoming, remaining = self._next()
+            if current is not None:
+                self._applied(current, self.apply_state(current.state))
+                continue
+            if upcoming is None:
+                return True
+            if remaining > 0:
+                with tracer.span('wait for transition', next=upcoming.at.strftime('%H:%M'), reason=upcoming.reason):
+                    self.clock.wait(self.wakeup, remaining)
+
+        self.log("Stop requested. Leaving the lighting plan.")
+        return False
+
+    async def run_async(self):
+        # The same loop on an asyncio event loop: apply_state is awaited and waiting holds no thread
+        self.loop = asyncio.get_running_loop()
+        self.async_wakeup = asyncio.Event()
+        self.running = True
+        try:
+            while not self.stop_event.is_set():
+                current, upcoming, remaining = self._next()
+                if current is not None:
+                    self._applied(current, await self.apply_state(current.state))
+                    continue
+                if upcoming is None:
+                    return True
+                if remaining > 0:
+                    try:
+                        await asyncio.wait_for(self.async_wakeup.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            self.log("Stop requested. Leaving the lighting plan.")
+            return False
+        finally:
+            self.running = False
+            self.loop = None
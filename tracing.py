@@ -0,0 +1,144 @@
+import cProfile
+import functools
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from config import PROFILE_DIR, TRACE_FILE
+
+_NO_SPAN = nullcontext()
+# From 3.12 one cProfile profiler sees every thread, and only one may be active in the process
+PROCESS_WIDE_PROFILER = sys.version_info >= (3, 12)
+
+
+class Tracer:
+    # Timed spans in Chrome trace format (load the file in Perfetto or chrome://tracing),
+    # plus a cProfile of the same spans while profiling is switched on
+    def __init__(self, path=TRACE_FILE, profile_dir=PROFILE_DIR):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.file = None
+        self.named_threads = set()
+        self.local = threading.local()
+        self.profiling = False
+        self.profiles = []
+        self.profiler = None
+        # Span times come from perf_counter but are written as wall-clock microseconds, to line up with the logs
+        self.origin = time.perf_counter()
+        self.epoch = time.time()
+
+    def span(self, name, **args):
+        if self.path is None and not (self.profiling and not PROCESS_WIDE_PROFILER):
+            return _NO_SPAN
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name, args):
+        profiler = None
+        if self.profiling and not PROCESS_WIDE_PROFILER and getattr(self.local, 'profiler', None) is None:
+            # Before 3.12 profilers are per thread, so each thread profiles from its outermost span
+            profiler = self._start_profiler()
+            self.local.profiler = profiler
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if profiler is not None:
+                profiler.disable()
+                self.local.profiler = None
+                with self.lock:
+                    self.profiles.append(profiler)
+            if self.path is not None:
+                self._write({'name': name, 'cat': 'court', 'ph': 'X', 'ts': self._micros(start),
+                             'dur': round((end - start) * 1e6), 'pid': self.pid,
+                             'tid': threading.get_ident(), 'args': args})
+
+    def _start_profiler(self):
+        # Never lets profiling break the code being profiled, e.g. when another profiler holds the hook
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            logging.warning(f"Could not start the profiler: {e}")
+            return None
+        return profiler
+
+    def _micros(self, moment):
+        return round((self.epoch + moment - self.origin) * 1e6)
+
+    def _write(self, event):
+        thread = threading.current_thread()
+        with self.lock:
+            try:
+                if self.file is None:
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    self.file = open(self.path, 'a')
+                    if self.file.tell() == 0:
+                        # The closing bracket is optional in the trace format, so the file is valid after a crash
+                        self.file.write('[\n')
+                lines = []
+                if event['tid'] not in self.named_threads:
+                    self.named_threads.add(event['tid'])
+                    lines.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': event['tid'],
+                                  'args': {'name': thread.name}})
+                lines.append(event)
+                self.file.write(''.join(json.dumps(line, default=str) + ',\n' for line in lines))
+                self.file.flush()
+            except OSError as e:
+                logging.warning(f"Could not write trace event, tracing stopped: {e}")
+                self.path = None
+
+    def toggle_profiling(self):
+        # First call starts profiling every span; the next one writes the collected profile and stops
+        if not self.profiling:
+            with self.lock:
+                self.profiles = []
+            if PROCESS_WIDE_PROFILER:
+                self.profiler = self._start_profiler()
+                if self.profiler is None:
+                    return None
+            self.profiling = True
+            logging.info("Profiling started; send the signal again to write the profile")
+            return None
+        self.profiling = False
+        if self.profiler is not None:
+            self.profiler.disable()
+            with self.lock:
+                self.profiles.append(self.profiler)
+            self.profiler = None
+        with self.lock:
+            profiles, self.profiles = self.profiles, []
+        if not profiles:
+            logging.info("Profiling stopped; no spans finished while it was on")
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.pstats")
+        stats.dump_stats(path)
+        logging.info(f"Profile written to {path}")
+        return path
+
+
+tracer = Tracer()
+
+
+def traced(name):
+    # Runs the whole function in a span
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
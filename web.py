@@ -1,15 +1,33 @@
-from flask import Flask, render_template, redirect, url_for, jsonify
+from flask import Flask, Response, render_template, redirect, request, url_for, jsonify
 import subprocess
 import threading
 import time
-from collections import deque
+from datetime import datetime, timedelta
 import io
+import os
+
+from analytics import PERIODS, usage
+from config import PREFETCH_DIR, RESERVATION_CACHE_FILE, SITES_FILE
+from engine import read_sites, reservations_file
+from logstore import LEVELS, LogStore
+from metrics import load_metrics, render_prometheus
+from state_cache import load_states
+from storage import read_json
+from timeline import DEFAULT_RULES, IntervalIndex, clean_court_names, compile_day, device_targets
 
 app = Flask(__name__)
-log_buffer = deque(maxlen=1000)  # Adjust this number to control how many log lines to keep
-log_lock = threading.Lock()
+log_store = LogStore()  # LOG_CAPACITY lines, searchable by level, court and time
+PAGE_LINES = 1000  # lines shown on the page and returned by default
+STREAM_KEEPALIVE = 15  # seconds between SSE comments on a quiet stream
 
 script_process = None
+status_indexes = {}  # site name ('' for the single court) -> ((day, fetched_at), IntervalIndex)
+
+def append_log(line):
+    log_store.append(line)
+
+def lines_since(since, limit=None):
+    return log_store.since(since, limit)
 
 def kill_existing_process():
     global script_process
@@ -18,7 +36,7 @@ def kill_existing_process():
         script_process.wait()
 
 def run_script():
-    global script_process, log_buffer
+    global script_process
     
     kill_existing_process()
     
@@ -32,20 +50,17 @@ def run_script():
         )
         
         for line in iter(script_process.stdout.readline, ''):
-            with log_lock:
-                log_buffer.append(line.strip())
+            append_log(line.strip())
         
         script_process.stdout.close()
         script_process.wait()
     except Exception as e:
-        with log_lock:
-            log_buffer.append(f"Error starting app.py: {str(e)}")
+        append_log(f"Error starting app.py: {str(e)}")
 
 @app.route('/')
 def index():
-    with log_lock:
-        log = '\n'.join(log_buffer)
-    return render_template('index.html', log=log)
+    entries, last = lines_since(0, PAGE_LINES)
+    return render_template('index.html', lines=[line for _, line in entries], last=last)
 
 @app.route('/restart')
 def restart_script():
@@ -53,11 +68,201 @@ def restart_script():
     thread.start()
     return redirect(url_for('index'))
 
+LOG_FILTERS = ('level', 'court', 'from', 'until', 'q')
+
 @app.route('/get_logs')
 def get_logs():
-    with log_lock:
-        log = '\n'.join(log_buffer)
-    return jsonify(log=log)
+    since = request.args.get('since', type=int)
+    limit = request.args.get('limit', PAGE_LINES, type=int)
+    if any(request.args.get(name) for name in LOG_FILTERS):
+        # e.g. /get_logs?level=ERROR&court=Half Court B&from=2024-09-01T00:00 (level is a minimum)
+        level = request.args.get('level', '').upper()
+        if level and level not in LEVELS:
+            return jsonify(error=f"level must be one of {', '.join(LEVELS)}"), 400
+        now = datetime.now()
+        try:
+            start, end = (parse_moment(request.args.get(name), now) if request.args.get(name) else None
+                          for name in ('from', 'until'))
+        except ValueError as e:
+            return jsonify(error=f"Invalid time: {e}"), 400
+        entries, last = log_store.query(
+            since=since or 0, level=LEVELS.index(level) if level else None, court=request.args.get('court'),
+            start=start.timestamp() if start else None, end=end.timestamp() if end else None,
+            text=request.args.get('q'), limit=limit)
+        return jsonify(entries=entries, lines=[entry['line'] for entry in entries], last=last)
+
+    entries, last = lines_since(since or 0, None if since else limit)
+    lines = [line for _, line in entries]
+    if since is None:
+        return jsonify(log='\n'.join(lines), last=last)
+    return jsonify(lines=lines, last=last)
+
+@app.route('/stream')
+def stream_logs():
+    since = request.headers.get('Last-Event-ID', type=int)
+    if since is None:
+        since = request.args.get('since', 0, type=int)
+
+    def events(since):
+        while True:
+            with log_store.added:
+                if log_store.last <= since:
+                    log_store.added.wait(STREAM_KEEPALIVE)
+            entries, _ = lines_since(since)
+            if not entries:
+                yield ": keepalive\n\n"
+                continue
+            since = entries[-1][0]
+            yield ''.join(f"id: {seq}\ndata: {line}\n\n" for seq, line in entries)
+
+    return Response(events(since), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def site_states(states, site=None):
+    # The engine stores its lights as "site/light"; a site's view drops the prefix
+    if site is None:
+        return states
+    prefix = f"{site.name}/"
+    return {key[len(prefix):]: entry for key, entry in states.items() if key.startswith(prefix)}
+
+def find_site(name):
+    # (site layout, error response); both None in single-court mode
+    if not os.path.exists(SITES_FILE):
+        return None, None
+    for site in read_sites(SITES_FILE):
+        if site.name == name:
+            return site, None
+    return None, (jsonify(error=f"Unknown site: {name}"), 404)
+
+@app.route('/device_states')
+def device_states():
+    site, error = find_site(request.args.get('site')) if request.args.get('site') else (None, None)
+    if error:
+        return error
+    return jsonify(site_states(load_states(), site))
+
+def cached_reservations(day, site=None):
+    if site is not None:
+        cache = read_json(reservations_file(site.name))
+        if not cache or cache.get('date') != day.strftime('%Y-%m-%d'):
+            return None, None
+        return cache['payload'].get('reservations'), cache.get('fetched_at')
+    # The latest copy wins: today's regular fetch or the prefetched file for that day
+    candidates = []
+    cache = read_json(RESERVATION_CACHE_FILE)
+    if cache and cache.get('date') == day.strftime('%Y-%m-%d'):
+        candidates.append(cache)
+    prefetched = read_json(os.path.join(PREFETCH_DIR, f"{day.strftime('%Y-%m-%d')}.json"))
+    if prefetched:
+        candidates.append(prefetched)
+    if not candidates:
+        return None, None
+    latest = max(candidates, key=lambda entry: entry.get('fetched_at') or '')
+    return latest['payload'].get('reservations'), latest.get('fetched_at')
+
+def plan_index(day, site=None):
+    # Rebuilt only when the day or the cached payload changes
+    reservations, fetched_at = cached_reservations(day, site)
+    key = (day, fetched_at)
+    name = site.name if site else ''
+    cached = status_indexes.get(name)
+    if cached is None or cached[0] != key:
+        rules = site.rules if site else DEFAULT_RULES
+        plan = compile_day(clean_court_names(reservations or {}), day, rules)
+        cached = status_indexes[name] = (key, IntervalIndex(plan, rules.all_off))
+    return cached[1], fetched_at
+
+def light_targets(site=None):
+    if site is None:
+        return device_targets
+    lights = sorted(site.lights)
+    return lambda state: [(light, light in state) for light in lights]
+
+def parse_moment(value, default):
+    if not value:
+        return default
+    if len(value) == 5:
+        return datetime.combine(default.date(), datetime.strptime(value, "%H:%M").time())
+    return datetime.fromisoformat(value)
+
+def describe_transition(transition, targets=device_targets):
+    return {
+        'at': transition.at.isoformat(timespec='seconds'),
+        'lights': dict(targets(transition.state)),
+        'reason': transition.reason,
+    }
+
+def status_body(at, until, states, site=None):
+    index, fetched_at = plan_index(at.date(), site)
+    targets = light_targets(site)
+    transition = index.transition_at(at)
+    upcoming = index.next_after(at)
+    body = {
+        'at': at.isoformat(timespec='seconds'),
+        'reservations_fetched_at': fetched_at,
+        'desired': dict(targets(index.state_at(at))),
+        'reason': transition.reason if transition else "before first transition",
+        'actual': site_states(states, site),
+        'next': describe_transition(upcoming, targets) if upcoming else None,
+    }
+    if until is not None:
+        body['intervals'] = [
+            {'from': start.isoformat(timespec='seconds'), 'until': end.isoformat(timespec='seconds'),
+             'lights': dict(targets(state)), 'reason': reason}
+            for start, end, state, reason in index.between(at, until)
+        ]
+    return body
+
+@app.route('/status')
+def status():
+    now = datetime.now()
+    try:
+        at = parse_moment(request.args.get('at'), now)
+        until = parse_moment(request.args.get('until'), at) if request.args.get('until') else None
+    except ValueError as e:
+        return jsonify(error=f"Invalid time: {e}"), 400
+
+    states = load_states()
+    if not os.path.exists(SITES_FILE):
+        return jsonify(status_body(at, until, states))
+    # With a sites file: /status?site=<name> for one site, otherwise every site by name
+    if request.args.get('site'):
+        site, error = find_site(request.args.get('site'))
+        return error or jsonify(status_body(at, until, states, site))
+    return jsonify({site.name: status_body(at, until, states, site) for site in read_sites(SITES_FILE)})
+
+def parse_day(value, default, last=False):
+    # YYYY-MM-DD, or YYYY-MM for the first (or last) day of that month
+    if not value:
+        return default
+    if len(value) == 7:
+        first = datetime.strptime(value, "%Y-%m").date()
+        if not last:
+            return first
+        return (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+@app.route('/usage')
+def usage_endpoint():
+    # Lights-on hours, time lit outside reservations and commands sent, per light and day or month
+    period = request.args.get('period', 'day')
+    if period not in PERIODS:
+        return jsonify(error=f"period must be one of {', '.join(PERIODS)}"), 400
+    today = datetime.now().date()
+    default_from = today - timedelta(days=29) if period == 'day' else today.replace(year=today.year - 1, day=1)
+    try:
+        first = parse_day(request.args.get('from'), default_from)
+        last = parse_day(request.args.get('until'), today, last=True)
+    except ValueError as e:
+        return jsonify(error=f"Invalid date: {e}"), 400
+    try:
+        return jsonify(usage(first, last, period))
+    except ImportError:
+        return jsonify(error="Usage analytics need NumPy (pip install numpy)"), 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(render_prometheus(load_metrics()), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     thread = threading.Thread(target=run_script)